@@ -5,7 +5,7 @@ from PyQt5.QtWidgets import QHBoxLayout, QLabel
 from mymodules import GDBModule as gdb
 from mymodules.ComponentsModule import PushButton, TableViewAutoCols
 from mymodules.GlobalFunctions import iconForButton, confirmationDialog
-from mymodules.ModelsModule import DrivesTableModel, DrivesItemsDelegate, DrivesMapper
+from mymodules.ModelsModule import DrivesTableModel, DrivesItemsDelegate, DrivesMapper, drives_status
 from mymodules.SystemModule import SystemClass
 
 COLUMN_SIZE = [0.10, 0.30, 0.20, 0.20, 0.10, 0.10]
@@ -66,6 +66,9 @@ class DrivesView(Drives):
         self.drives_table_model = DrivesTableModel()
 
         self.drives_table_model.dataChanged.connect(self.validateData)
+        # drives are selected again when they are mounted or unmounted and when a label is changed,
+        # so result tables show their status without reading it for each cell
+        self.drives_table_model.modelReset.connect(drives_status.refresh)
         self.drives_table_model.select()
 
         self.drives_table.setModel(self.drives_table_model)
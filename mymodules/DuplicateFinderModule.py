@@ -1,14 +1,13 @@
 import os
 
-import pandas as pd
-from PyQt5 import QtWidgets, QtCore, QtTest
-from PyQt5.QtCore import Qt
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtCore import Qt, QThreadPool
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QAbstractItemView, QFileDialog, QLabel
 
 from mymodules import ComponentsModule, ModelsModule
-from mymodules import GDBModule as gdb
 from mymodules.ComponentsModule import PushButton
+from mymodules.DuplicateHashModule import DuplicateHasher
 from mymodules.GlobalFunctions import HEADER_DUPLICATES_TABLE, spinner, CSV_COLUMN_SEPARATOR, getPreference, \
     getDefaultDir, CSV_LINE_SEPARATOR
 
@@ -18,7 +17,7 @@ class DuplicateFinder(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super(DuplicateFinder, self).__init__(parent)
 
-        self.find_duplicate_label = QLabel('Find duplicates by name and size')
+        self.find_duplicate_label = QLabel('Find duplicates by content')
         self.find_duplicate_button = PushButton('Find')
         self.find_duplicate_button.setMinimumWidth(200)
         self.find_duplicate_button.setIcon(QIcon(':magnifier.png'))
@@ -43,7 +42,7 @@ class DuplicateFinder(QtWidgets.QWidget):
         self.duplicate_results_table = ComponentsModule.TableViewAutoCols(None)
         self.duplicate_results_table.setColumns([0.35, 0.25, 0.10, 0.10, 0.15, 0.05])
         self.duplicate_results_table_model = ModelsModule.DuplicateResultsTableModel(
-            pd.DataFrame([], columns=HEADER_DUPLICATES_TABLE), self.duplicate_results_table)
+            [], self.duplicate_results_table)
 
         v_lay_find_duplicates = QtWidgets.QVBoxLayout()
         v_lay_find_duplicates.addWidget(self.find_duplicate_label)
@@ -75,25 +74,61 @@ class DuplicateFinder(QtWidgets.QWidget):
         self.find_duplicate_tab_layout = QtWidgets.QVBoxLayout()
         self.find_duplicate_tab_layout.addLayout(v_lay)
 
+        self.hasher = None
+
     @QtCore.pyqtSlot()
     def findDuplicates(self):
         self.searching_label.show()
         self.spinner.show()
         self.searching_label.setText(f'Please wait! Searching for duplicates...')
         self.searching_label.show()
-        QtTest.QTest.qWait(1000)
-        results = gdb.findDuplicates()
-        if results:
-            self.updateResults(results)
+        self.find_duplicate_button.setEnabled(False)
+        # files are hashed in background, only those with the same size as others
+        self.hasher = DuplicateHasher()
+        self.hasher.signals.progress.connect(self.onHashProgress)
+        self.hasher.signals.finished.connect(self.onDuplicatesFound)
+        self.hasher.signals.failed.connect(self.onDuplicatesFailed)
+        QThreadPool.globalInstance().start(self.hasher)
+
+    def cancel(self):
+        """ stop hashing, when the application is closed """
+        if self.hasher is not None:
+            self.hasher.cancel()
+
+    @QtCore.pyqtSlot(str, int, int)
+    def onHashProgress(self, stage, done, total):
+        stages = {'unchanged': 'Checking size and date of', 'partial_hash': 'Comparing start and end of',
+                  'full_hash': 'Comparing content of'}
+        self.searching_label.setText(f'Please wait! {stages[stage]} {done} / {total} files...')
+
+    @QtCore.pyqtSlot(object, object)
+    def onDuplicatesFound(self, results, groups):
+        self.hasher = None
+        self.find_duplicate_button.setEnabled(True)
+        self.updateResults(results, groups)
+
+    @QtCore.pyqtSlot(str)
+    def onDuplicatesFailed(self, message):
+        self.hasher = None
+        self.find_duplicate_button.setEnabled(True)
+        self.spinner.hide()
+        self.searching_label.setText('Search failed')
+        QtWidgets.QMessageBox.warning(None, 'Search failed', message)
 
-    def updateResults(self, results):
+    def updateResults(self, results, groups):
         self.duplicate_results_table.show()
 
+        old_model = self.duplicate_results_table_model
+        old_selection = self.duplicate_results_table.selectionModel()
         self.duplicate_results_table_model = ModelsModule.DuplicateResultsTableModel(
-            pd.DataFrame(results, columns=HEADER_DUPLICATES_TABLE), self.duplicate_results_table)
+            results, self.duplicate_results_table, groups)
 
         self.duplicate_results_table.setModel(self.duplicate_results_table_model)
         self.duplicate_results_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # the view doesn't delete the model and the selection it replaces
+        old_model.release()
+        if old_selection is not None:
+            old_selection.deleteLater()
         self.spinner.hide()
         count_results = len(results) if results else 0
         self.searching_label.setText(f'Found: {count_results} results')
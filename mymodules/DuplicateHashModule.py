@@ -0,0 +1,227 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, QRunnable, pyqtSlot
+
+from mymodules import GDBModule
+
+# the partial hash reads a block from the start and one from the end of file
+HASH_BLOCK_SIZE = 64 * 1024
+# the full hash reads the file in chunks of this size
+HASH_CHUNK_SIZE = 1024 * 1024
+# drives hashed at the same time, each drive is read by a single thread
+HASH_MAX_THREADS = 8
+# progress is sent after this many files
+HASH_PROGRESS_STEP = 100
+HASHER_CONNECTION = 'duplicate_hasher_connection'
+CANDIDATE_COLUMNS = ['id', 'dir', 'filename', 'size', 'mtime', 'extension', 'label', 'drive_id', 'active',
+                     'partial_hash', 'full_hash']
+
+
+def newHash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def partialHash(path, size):
+    """
+    :param path:
+    :param size: size of file
+    :return: hash of the first and the last block of file
+    a file not larger than two blocks is read whole, so its partial hash is also its full hash
+    """
+    digest = newHash()
+    with open(path, 'rb') as file:
+        digest.update(file.read(HASH_BLOCK_SIZE))
+        if size > 2 * HASH_BLOCK_SIZE:
+            file.seek(-HASH_BLOCK_SIZE, os.SEEK_END)
+        digest.update(file.read(HASH_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def fullHash(path, size):
+    """
+    :param path:
+    :param size: size of file
+    :return: hash of the whole content of file
+    """
+    digest = newHash()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sameFiles(files, key):
+    """
+    :param files: candidates, as dictionaries of CANDIDATE_COLUMNS
+    :param key: column compared besides size
+    :return: groups of files having the same size and key, with two files at least
+    """
+    groups = {}
+    for file in files:
+        if file[key] is not None:
+            groups.setdefault((file['size'], file[key]), []).append(file)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class DuplicateHasherSignals(QObject):
+    progress = QtCore.pyqtSignal(str, int, int)
+    finished = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(str)
+
+
+class DuplicateHasher(QRunnable):
+    """
+    Finds the files having the same content, in stages, each one for fewer files
+        files with the same size, from the database
+        files with the same hash of their first and last blocks
+        files with the same hash of their whole content
+    only the hashes missing from file_hashes are computed, then they are saved there for the next searches
+    the files of each mounted drive are hashed by their own thread, so the drives are read at the same time
+    files on unmounted drives are compared by the hashes saved while they were mounted
+    finished sends the rows of results and the group of each row
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.signals = DuplicateHasherSignals()
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.findDuplicates()
+        except Exception as e:
+            print(f"Duplicates search stopped by an error: {str(e)}")
+            self.signals.failed.emit(str(e))
+        finally:
+            # the connection of findDuplicates is deleted when it returns
+            GDBModule.removeConnection(HASHER_CONNECTION)
+
+    def findDuplicates(self):
+        # the connection is used only by the thread opening it
+        con = GDBModule.connection(HASHER_CONNECTION, 'interactive')
+        try:
+            GDBModule.removeStaleHashes(con)
+            rows = GDBModule.duplicateCandidates(con)
+            if rows is None:
+                self.signals.failed.emit('Could not read the indexed files')
+                return
+            candidates = self.checkSavedHashes([dict(zip(CANDIDATE_COLUMNS, row)) for row in rows])
+            candidates = self.hashStage(con, candidates, 'size', 'partial_hash', partialHash)
+            candidates = self.hashStage(con, candidates, 'partial_hash', 'full_hash', fullHash)
+            if self.cancelled:
+                return
+            rows, groups = [], []
+            for number, group in enumerate(sameFiles(candidates, 'full_hash')):
+                for file in group:
+                    rows.append([file['dir'], file['filename'], file['size'], file['extension'], file['label'], 0])
+                    groups.append(number)
+            self.signals.finished.emit(rows, groups)
+        finally:
+            con.close()
+
+    def cancel(self):
+        """ stop hashing, the hashes computed until now are saved """
+        self.cancelled = True
+
+    def hashStage(self, con, candidates, key, hash_column, hash_function):
+        """
+        :param con: connection
+        :param candidates: files found by the previous stage
+        :param key: column grouping the files of the previous stage
+        :param hash_column: column computed by this stage
+        :param hash_function: partialHash or fullHash
+        :return: files of groups having the same key, with their hash_column
+        """
+        files = [file for group in sameFiles(candidates, key) for file in group]
+        missing = [file for file in files if file[hash_column] is None and file['active'] and not self.cancelled]
+        hashes = self.hashFiles(missing, hash_column, hash_function)
+        for file in missing:
+            file[hash_column] = hashes.get(file['id'])
+            # a small file was read whole
+            if hash_column == 'partial_hash' and file['size'] <= 2 * HASH_BLOCK_SIZE:
+                file['full_hash'] = file['partial_hash']
+        GDBModule.saveFileHashes(con, [(file['id'], file['size'], file['mtime'], file['partial_hash'],
+                                        file['full_hash']) for file in missing if file['id'] in hashes])
+        # files which could not be hashed are not compared anymore
+        return [file for file in files if file[hash_column] is not None]
+
+    def checkSavedHashes(self, candidates):
+        """
+        :param candidates: files with the same size as other files
+        :return: candidates without the files on mounted drives changed or removed since their hashes were saved
+        they are not compared, neither by their saved hash, the files which are deleted as duplicates must be the same
+        """
+        saved = [file for file in candidates if file['active'] and file['partial_hash'] is not None]
+        changed = set()
+        for drive_changed in self.eachDrive(saved, self.changedDriveFiles):
+            changed.update(drive_changed)
+        return [file for file in candidates if file['id'] not in changed]
+
+    def changedDriveFiles(self, files):
+        changed = []
+        for file in files:
+            if self.cancelled:
+                break
+            if not self.unchanged(file):
+                changed.append(file['id'])
+            self.advance('unchanged')
+        return changed
+
+    def eachDrive(self, files, function):
+        """
+        :param files:
+        :param function: called with the files of a drive
+        :return: results of function for each drive, the drives are read at the same time, each by its own thread
+        """
+        drives = {}
+        for file in files:
+            drives.setdefault(file['drive_id'], []).append(file)
+        self.done, self.total = 0, len(files)
+        if not drives:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(drives), HASH_MAX_THREADS)) as executor:
+            return list(executor.map(function, drives.values()))
+
+    def hashFiles(self, files, stage, hash_function):
+        """ hash the files of each drive in its own thread """
+        hashes = {}
+        for drive_hashes in self.eachDrive(files, lambda drive_files: self.hashDriveFiles(drive_files, stage,
+                                                                                        hash_function)):
+            hashes.update(drive_hashes)
+        return hashes
+
+    def hashDriveFiles(self, files, stage, hash_function):
+        hashes = {}
+        for file in files:
+            if self.cancelled:
+                break
+            try:
+                if self.unchanged(file):
+                    hashes[file['id']] = hash_function(os.path.join(file['dir'], file['filename']), file['size'])
+            except OSError:
+                pass
+            self.advance(stage)
+        return hashes
+
+    @staticmethod
+    def unchanged(file):
+        """ the file has the size and mtime it was indexed with """
+        try:
+            status = os.stat(os.path.join(file['dir'], file['filename']))
+        except OSError:
+            return False
+        return status.st_size == file['size'] and file['mtime'] in (None, status.st_mtime_ns)
+
+    def advance(self, stage):
+        with self.lock:
+            self.done += 1
+            if self.done % HASH_PROGRESS_STEP == 0 or self.done == self.total:
+                self.signals.progress.emit(stage, self.done, self.total)
@@ -0,0 +1,215 @@
+import re
+
+import numpy as np
+
+# columns of FileResults, as in HEADER_SEARCH_RESULTS_TABLE
+RESULT_COLUMNS = ['dir', 'filename', 'size', 'extension', 'drive']
+# rows having the same value in the sorted column are ordered by directory, then by filename
+SORT_TIE_COLUMNS = [0, 1]
+NUMBER_PATTERN = re.compile(r'\d+')
+# numbers are compared by value as strings padded with zeros to this width, longer than a 64 bit number
+NUMBER_WIDTH = 20
+
+
+class IntColumn:
+    """
+    Integers in a typed array, grown by doubling its capacity, so pages of results are appended
+    without copying all the previous rows each time
+    """
+
+    def __init__(self, dtype=np.int64):
+        self.array = np.empty(0, dtype=dtype)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        return int(self.array[row])
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.array.dtype)
+        end = self.length + len(values)
+        if end > len(self.array):
+            grown = np.empty(max(end, 2 * len(self.array)), dtype=self.array.dtype)
+            grown[:self.length] = self.array[:self.length]
+            self.array = grown
+        self.array[self.length:end] = values
+        self.length = end
+
+    def values(self):
+        return self.array[:self.length]
+
+    def sortKeys(self):
+        """ :return: integers ordered as the values of column """
+        return self.values()
+
+
+class StringColumn(IntColumn):
+    """
+    Strings encoded by a dictionary, each row keeps only the int32 code of its string
+    a directory, extension or drive found in many rows is kept once
+    """
+
+    def __init__(self, key):
+        """ :param key: function giving the key of a string, strings are sorted by it """
+        super().__init__(np.int32)
+        self.key = key
+        self.strings = []
+        self.codes = {}
+        # rank of each code in the sorted strings, computed when the column is sorted
+        self.ranks = None
+
+    def __getitem__(self, row):
+        return self.strings[self.array[row]]
+
+    def extend(self, values):
+        codes = self.codes
+        strings = self.strings
+        encoded = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(strings)
+                strings.append(value)
+                self.ranks = None
+            encoded.append(code)
+        super().extend(encoded)
+
+    def sortKeys(self):
+        """ :return: ranks of the strings, so a column is sorted by comparing integers """
+        if self.ranks is None:
+            self.ranks = sortRanks(self.strings, self.key)
+        return self.ranks[self.values()]
+
+
+class TextColumn:
+    """
+    Strings of a column having mostly distinct values, like filename, kept in a list
+    a dictionary would keep each of them once more
+    """
+
+    def __init__(self, key):
+        """ :param key: function giving the key of a string, strings are sorted by it """
+        self.key = key
+        self.strings = []
+        self.ranks = None
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, row):
+        return self.strings[row]
+
+    def extend(self, values):
+        self.strings.extend(values)
+        self.ranks = None
+
+    def sortKeys(self):
+        """ :return: ranks of the strings, the same string has the same rank """
+        if self.ranks is None:
+            self.ranks = sortRanks(self.strings, self.key)
+        return self.ranks
+
+
+class RowBitmap:
+    """
+    A flag for each row, kept in a bit, eight rows in a byte
+    """
+
+    def __init__(self, values):
+        """ :param values: bool for each row """
+        self.bits = np.packbits(np.asarray(values, dtype=bool), bitorder='little')
+
+    def __getitem__(self, row):
+        return bool(self.bits[row >> 3] >> (row & 7) & 1)
+
+    def __setitem__(self, row, value):
+        mask = 1 << (row & 7)
+        if value:
+            self.bits[row >> 3] |= mask
+        else:
+            self.bits[row >> 3] &= 0xFF ^ mask
+
+
+def naturalKey(text):
+    """
+    :param text:
+    :return: key comparing the numbers in text by their value and the rest ignoring case,
+    so file2 is before File10
+    """
+    # a single string is compared faster than the parts of text
+    return NUMBER_PATTERN.sub(lambda number: number.group().zfill(NUMBER_WIDTH), text.casefold())
+
+
+def sortRanks(strings, key=naturalKey):
+    """
+    :param strings: list
+    :param key: function giving the key of a string
+    :return: int32 array of the rank of each string in the order of key, strings with equal keys have the same rank
+    """
+    keys = [key(string) for string in strings]
+    order = sorted(range(len(strings)), key=keys.__getitem__)
+    ranks = np.empty(len(strings), dtype=np.int32)
+    if strings:
+        ordered = [keys[row] for row in order]
+        distinct = [True] + [key != previous for previous, key in zip(ordered, ordered[1:])]
+        ranks[order] = np.cumsum(distinct, dtype=np.int32)
+    return ranks
+
+
+class FileResults:
+    """
+    Rows of found files, kept by columns: directories, extensions and drives encoded by dictionaries,
+    filenames in a list and sizes as int64
+    the models of results read a cell with value(row, column) and sort by sortPermutation,
+    which compares integers instead of Python objects
+    the rows are never moved, a sorted model reads them in the order of a permutation,
+    which is computed once for each column and order
+    """
+
+    def __init__(self, rows=None, key=naturalKey):
+        """
+        :param rows: [[dir, filename, size, extension, drive], ...], other columns of rows are ignored
+        :param key: function giving the key of a string, strings of columns are sorted by it
+        """
+        self.columns = [StringColumn(key), TextColumn(key), IntColumn(), StringColumn(key), StringColumn(key)]
+        self.permutations = {}
+        if rows:
+            self.extend(rows)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def extend(self, rows):
+        for index, column in enumerate(self.columns):
+            column.extend([row[index] for row in rows])
+        self.permutations.clear()
+
+    def value(self, row, column):
+        return self.columns[column][row]
+
+    def row(self, row):
+        return [column[row] for column in self.columns]
+
+    def rows(self):
+        return [self.row(row) for row in range(len(self))]
+
+    def sortPermutation(self, column, descending=False, ties=None):
+        """
+        :param column: index of RESULT_COLUMNS
+        :param descending:
+        :param ties: integer for each row, comparing the rows with the same value before SORT_TIE_COLUMNS,
+        the same for each call, like the groups of duplicates
+        :return: rows in sorted order, cached until rows are added
+        """
+        key = (column, descending)
+        if key not in self.permutations:
+            # lexsort compares the last key first
+            keys = [self.columns[tie].sortKeys() for tie in reversed(SORT_TIE_COLUMNS) if tie != column]
+            if ties is not None:
+                keys.append(ties)
+            primary = self.columns[column].sortKeys()
+            keys.append(-primary if descending else primary)
+            self.permutations[key] = np.lexsort(keys)
+        return self.permutations[key]
@@ -103,7 +103,7 @@ class Folders(QtWidgets.QWidget):
     def stopIndexer(self):
         confirmation_text = f"Do you wish to stop current indexing?" \
                             f"<br>The current folder will not be completely indexed. " \
-                            f"You have to reindex it later!<br>Do you proceed?"
+                            f"The next index will continue from where it was stopped.<br>Do you proceed?"
         confirm = confirmationDialog("Stop indexing?", confirmation_text)
         if not confirm:
             return
@@ -277,14 +277,7 @@ def deleteFilesDB(folder_id: int) -> bool:
     :param folder_id:
     :return:
     """
-    query = QtSql.QSqlQuery()
-    query.prepare("""Delete from files where folder_id=:folder_id""")
-    query.bindValue(':folder_id', folder_id)
-    if query.exec():
-        query.clear()
-        return True
-    else:
-        printQueryErr(query, 'deleteFilesDB')
+    return deleteIndexed(['files', 'directories'], "folder_id=?", [folder_id])
 
 
 def cleanRemovedDuplicates(directory: str, filename: str) -> bool:
@@ -293,15 +286,8 @@ def cleanRemovedDuplicates(directory: str, filename: str) -> bool:
     :param filename:
     :return:
     """
-    query = QtSql.QSqlQuery()
-    query.prepare("""Delete from files where dir=:dir AND filename=:filename""")
-    query.bindValue(':dir', directory)
-    query.bindValue(':filename', filename)
-    if query.exec():
-        query.clear()
-        return True
-    else:
-        printQueryErr(query, 'cleanRemovedDuplicates')
+    return deleteIndexed(['files'], "dir_id IN (SELECT id FROM directories WHERE path=?) AND filename=?",
+                         [directory, filename])
 
 
 def extensionId(extension: str) -> int:
@@ -387,113 +373,501 @@ def extensionsIdNameDict(extensions_name_list: list) -> dict:
         return extensions
 
 
-def findFiles(search_term: str, extensions: list) -> list:
+# files_fts and directories_fts are external content tables over files and directories, they store only the index
+# they are updated where rows are inserted and deleted: FTS5 inside triggers is several times slower for bulk inserts
+SEARCH_INDEX_COMMANDS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+    "   filename, content='files', content_rowid='id', tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS directories_fts USING fts5("
+    "   path, content='directories', content_rowid='id', tokenize='trigram')",
+]
+SEARCH_INDEX_REBUILD = [
+    "INSERT INTO files_fts(files_fts) VALUES('rebuild')",
+    "INSERT INTO directories_fts(directories_fts) VALUES('rebuild')",
+]
+# indexed column of each table
+SEARCH_INDEX_COLUMNS = {'files': 'filename', 'directories': 'path'}
+# removes from index the rows selected by a condition, it must run before they are deleted
+SEARCH_INDEX_DELETE = "INSERT INTO {table}_fts({table}_fts, rowid, {column}) " \
+                      "SELECT 'delete', id, {column} FROM {table} WHERE {condition}"
+# adds to index the rows inserted after a known id
+SEARCH_INDEX_INSERT = "INSERT INTO {table}_fts(rowid, {column}) SELECT id, {column} FROM {table} WHERE id > ?"
+
+# the trigram index finds only terms of at least 3 characters
+SEARCH_INDEX_MIN_LENGTH = 3
+
+
+def searchIndexSupported() -> bool:
     """
-    :param search_term:
-    :param extensions:
     :return:
-    search for a term
+    check if SQLite has FTS5 with the trigram tokenizer
     """
-    extensions_list_ids = extensionsToInt(extensions) or []
-    placeholder = ','.join("?" * len(extensions_list_ids))
     query = QtSql.QSqlQuery()
-    # if len(extensions_list_ids) > 0:
-    query.prepare("select f.dir, f.filename, f.size, e.extension, d.label "
-                  "from files f "
-                  "left join extensions e on e.id=f.extension_id "
-                  "left join folders fo on fo.id=f.folder_id "
-                  "left join drives d on d.serial=fo.drive_id "
-                  "where (f.extension_id in (%s) or f.extension_id is null) and (f.dir like ? or f.filename like ?)" % placeholder)
-    for binder in extensions_list_ids:
-        query.addBindValue(binder)
-    query.addBindValue("%" + search_term + "%")
-    query.addBindValue("%" + search_term + "%")
+    supported = query.exec("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+    if supported:
+        query.exec("DROP TABLE temp.fts_probe")
+    query.clear()
+    return supported
 
-    if query.exec():
-        results = []
-        while query.next():
-            item = [
-                query.value('dir'),
-                query.value('filename'),
-                query.value('size'),
-                query.value('extension'),
-                query.value('label')
-            ]
-            results.append(item)
-        query.clear()
-        return results
-
-
-def findDuplicates():
-    query = QtSql.QSqlQuery()
-    query.prepare("""WITH cte AS (
-        SELECT f.dir, f.filename, f.size, e.extension, d.label, count(*) as Occurrence
-        FROM files f 
-        LEFT JOIN extensions e on e.id=f.extension_id
-        LEFT JOIN folders fo on fo.id=f.folder_id
-        LEFT JOIN drives d on d.serial=fo.drive_id
-        GROUP BY f.size, f.filename
-        HAVING COUNT(*) > 1
-        )
-        SELECT f.dir, f.filename, f.size, e.extension, d.label
-        FROM  files f
-            INNER JOIN cte ON cte.filename = f.filename AND cte.size = f.size
-            LEFT JOIN extensions e on e.id=f.extension_id
-            LEFT JOIN folders fo on fo.id=f.folder_id
-            LEFT JOIN drives d on d.serial=fo.drive_id
-        ORDER BY f.size DESC""")
 
-    if query.exec():
-        results = []
-        while query.next():
-            item = [
-                query.value('dir'),
-                query.value('filename'),
-                query.value('size'),
-                query.value('extension'),
-                query.value('label'),
-                0
-            ]
-            results.append(item)
-        query.clear()
-        return results
-
-
-def findDuplicatesBySize():
-    query = QtSql.QSqlQuery()
-    query.prepare("""WITH cte AS (
-        SELECT f.dir, f.filename, f.size, e.extension, d.label, count(*) as Occurrence
-        FROM files f 
-            LEFT JOIN extensions e on e.id=f.extension_id
-            LEFT JOIN folders fo on fo.id=f.folder_id
-            LEFT JOIN drives d on d.serial=fo.drive_id
-        WHERE d.active = 1
-        GROUP BY f.size, f.filename
-        HAVING COUNT(*) > 1
-        )
-        SELECT f.dir, f.filename, f.size, e.extension, d.label
-        FROM  files f
-            INNER JOIN cte ON cte.size = f.size
-            LEFT JOIN extensions e on e.id=f.extension_id
-            LEFT JOIN folders fo on fo.id=f.folder_id
-            LEFT JOIN drives d on d.serial=fo.drive_id
-        WHERE d.active = 1
-        ORDER BY f.size DESC""")
+def searchIndexStatement(statement: str, table: str, condition: str = '') -> str:
+    """
+    :param statement: SEARCH_INDEX_DELETE or SEARCH_INDEX_INSERT
+    :param table: files or directories
+    :param condition: where condition for SEARCH_INDEX_DELETE
+    :return:
+    """
+    return statement.format(table=table, column=SEARCH_INDEX_COLUMNS[table], condition=condition)
+
+
+def searchIndexExists(con=None) -> bool:
+    query = QtSql.QSqlQuery(con or QtSql.QSqlDatabase.database())
+    exists = query.exec("SELECT 1 FROM sqlite_master WHERE type='table' AND name='files_fts'") and query.first()
+    query.clear()
+    return exists
+
+
+def removeFromSearchIndex(table: str, condition: str, values: list, con=None) -> bool:
+    """
+    :param table: files or directories
+    :param condition: where condition selecting rows, with ? placeholders
+    :param values: values for placeholders
+    :param con: connection, the default one if missing
+    :return:
+    remove from search index the rows which will be deleted
+    """
+    if not searchIndexExists(con):
+        return True
+    query = QtSql.QSqlQuery(con or QtSql.QSqlDatabase.database())
+    query.prepare(searchIndexStatement(SEARCH_INDEX_DELETE, table, condition))
+    for value in values:
+        query.addBindValue(value)
+    if not query.exec():
+        printQueryErr(query, 'removeFromSearchIndex')
+        return False
+    query.clear()
+    return True
+
+
+def rebuildSearchIndex() -> bool:
+    """
+    :return:
+    create the search index if missing and fill it again from files and directories, in a transaction
+    """
+    if not searchIndexSupported():
+        return False
+    con = QtSql.QSqlDatabase.database()
+    con.transaction()
+    query = QtSql.QSqlQuery()
+    for command in SEARCH_INDEX_COMMANDS + SEARCH_INDEX_REBUILD:
+        if not query.exec(command):
+            printQueryErr(query, 'rebuildSearchIndex')
+            con.rollback()
+            return False
+    query.clear()
+    return con.commit()
+
+
+# count and bytes of indexed files for each folder and extension, files without extension are counted for 0
+# reports group these rows by drive, category or extension, instead of all the files
+STATISTICS_COMMANDS = [
+    'CREATE TABLE IF NOT EXISTS file_stats('
+    '   folder_id INTEGER NOT NULL, '
+    '   extension_id INTEGER NOT NULL, '
+    '   files INTEGER NOT NULL DEFAULT 0, '
+    '   bytes INTEGER NOT NULL DEFAULT 0, '
+    '   PRIMARY KEY (folder_id, extension_id)) WITHOUT ROWID',
+]
+STATISTICS_UPDATE = "INSERT INTO file_stats (folder_id, extension_id, files, bytes) " \
+                    "SELECT folder_id, ifnull(extension_id, 0), {sign}count(*), {sign}ifnull(sum(size), 0) " \
+                    "FROM files WHERE {condition} GROUP BY folder_id, extension_id " \
+                    "ON CONFLICT(folder_id, extension_id) DO UPDATE " \
+                    "SET files=files+excluded.files, bytes=bytes+excluded.bytes"
+# groups left without files are removed
+STATISTICS_CLEAN = "DELETE FROM file_stats WHERE files=0"
+
+
+def statisticsStatement(condition: str, remove: bool = False) -> str:
+    """
+    :param condition: where condition selecting files, with ? placeholders
+    :param remove: the files are subtracted from statistics, otherwise added
+    :return:
+    """
+    return STATISTICS_UPDATE.format(sign='-' if remove else '', condition=condition)
 
-    if query.exec():
-        results = []
-        while query.next():
-            item = [
-                query.value('dir'),
-                query.value('filename'),
-                query.value('size'),
-                query.value('extension'),
-                query.value('label'),
-                0
-            ]
-            results.append(item)
-        query.clear()
-        return results
+
+def removeFromStatistics(condition: str, values: list, con=None) -> bool:
+    """
+    :param condition: where condition selecting files, with ? placeholders
+    :param values: values for placeholders
+    :param con: connection, the default one if missing
+    :return:
+    remove from statistics the files which will be deleted
+    """
+    query = QtSql.QSqlQuery(con or QtSql.QSqlDatabase.database())
+    query.prepare(statisticsStatement(condition, remove=True))
+    for value in values:
+        query.addBindValue(value)
+    if not query.exec() or not query.exec(STATISTICS_CLEAN):
+        printQueryErr(query, 'removeFromStatistics')
+        return False
+    query.clear()
+    return True
+
+
+def deleteIndexed(tables: list, condition: str, values: list, con=None) -> bool:
+    """
+    :param tables: tables of indexed rows, files and directories
+    :param condition: where condition selecting the rows of each table, with ? placeholders
+    :param values: values for placeholders
+    :param con: connection, the default one if missing
+    :return:
+    delete indexed rows with their search index and statistics in a single transaction,
+    so a failure doesn't leave the rows counted or searchable after they are deleted
+    """
+    con = con or QtSql.QSqlDatabase.database()
+    query = QtSql.QSqlQuery(con)
+    # the write lock is taken when the transaction begins, as in FilesWriter
+    if not query.exec("BEGIN IMMEDIATE"):
+        printQueryErr(query, 'deleteIndexed')
+        return False
+    deleted = all(removeFromSearchIndex(table, condition, values, con) for table in tables) \
+        and removeFromStatistics(condition, values, con)
+    for table in tables:
+        if not deleted:
+            break
+        query.prepare(f"DELETE FROM {table} WHERE {condition}")
+        for value in values:
+            query.addBindValue(value)
+        deleted = query.exec()
+        if not deleted:
+            printQueryErr(query, 'deleteIndexed')
+    query.clear()
+    if deleted and con.commit():
+        return True
+    con.rollback()
+    return False
+
+
+def recomputeStatistics() -> bool:
+    """
+    :return:
+    count again all the indexed files, to verify the statistics kept while indexing
+    """
+    con = QtSql.QSqlDatabase.database()
+    con.transaction()
+    query = QtSql.QSqlQuery()
+    for command in STATISTICS_COMMANDS + ['DELETE FROM file_stats', statisticsStatement('1')]:
+        if not query.exec(command):
+            printQueryErr(query, 'recomputeStatistics')
+            con.rollback()
+            return False
+    query.clear()
+    return con.commit()
+
+
+# results of a search are loaded in pages, ordered by a column of the results table and the id of file
+SEARCH_PAGE_SIZE = 500
+# the count of results stops here, to be fast also for terms found in most of the files
+SEARCH_COUNT_LIMIT = 100000
+# the first page of a search is larger, when all results fit in it they are kept to refine the search in memory
+SEARCH_REFINE_LIMIT = 2000
+# pages of results kept in memory by a results table, at most this many rows, the others are searched again
+SEARCH_WINDOW_ROWS = 20000
+# files are searched in steps of this many ids, a cancelled search stops at the end of a step
+SEARCH_STEP_FILES = 50000
+SEARCH_RESULT_COLUMNS = "di.path as dir, f.filename, f.size, e.extension, d.label"
+# sort key of each column of HEADER_SEARCH_RESULTS_TABLE, NULL is replaced to be compared in keyset
+# names are ordered ignoring case, sizes are never NULL so their key is the column
+# no index serves these orders, each step of a search sorts its own rows, at most SEARCH_STEP_FILES of them
+SEARCH_SORT_KEYS = ["di.path COLLATE NOCASE", "f.filename COLLATE NOCASE", "f.size",
+                    "ifnull(e.extension, '') COLLATE NOCASE", "ifnull(d.label, '') COLLATE NOCASE"]
+# NOCASE folds only ASCII letters, rows of steps are merged folding them in the same way
+NOCASE_TABLE = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+class SearchError(Exception):
+    """ a search query failed, the message is the error of database """
+
+
+def searchIndexUsable(con=None) -> bool:
+    """
+    :param con: connection, the default one if None
+    :return:
+    check if the search index exists and the trigram tokenizer is available for this connection
+    """
+    query = QtSql.QSqlQuery(con) if con is not None else QtSql.QSqlQuery()
+    usable = query.exec("SELECT 1 FROM files_fts WHERE files_fts MATCH '\"abc\"' LIMIT 1")
+    query.clear()
+    return usable
+
+
+def searchRows(con, sql: str, values: list) -> list:
+    """
+    :param con: connection, the default one if None
+    :param sql:
+    :param values: bound in order
+    :return: rows of the query, NULL as None
+    raise SearchError if the query fails
+    """
+    query = QtSql.QSqlQuery(con) if con is not None else QtSql.QSqlQuery()
+    query.setForwardOnly(True)
+    query.prepare(sql)
+    for value in values:
+        query.addBindValue(value)
+    if not query.exec():
+        raise SearchError(query.lastError().text())
+    columns = query.record().count()
+    rows = []
+    while query.next():
+        rows.append([None if query.isNull(column) else query.value(column) for column in range(columns)])
+    query.clear()
+    return rows
+
+
+def fileIdSteps(con, descending: bool = False, start: int = None) -> list:
+    """
+    :param con: connection, the default one if None
+    :param descending:
+    :param start: first id of the steps, None to start from the first or last file
+    :return: [(low, high), ...] ranges of ids of files, SEARCH_STEP_FILES ids each
+    """
+    first, last = searchRows(con, "select min(id), max(id) from files", [])[0]
+    if first is None:
+        return []
+    if start is not None:
+        first, last = (first, min(last, start)) if descending else (max(first, start), last)
+    steps = [(low, min(low + SEARCH_STEP_FILES - 1, last)) for low in range(first, last + 1, SEARCH_STEP_FILES)]
+    return steps[::-1] if descending else steps
+
+
+def nocaseKey(text: str) -> str:
+    """ :return: key ordering strings as COLLATE NOCASE, ASCII letters ignoring case """
+    return text.translate(NOCASE_TABLE)
+
+
+def sortKey(row: list) -> tuple:
+    """
+    :param row: row of findFilesPage, ending with id and sort key
+    :return: key ordering rows as the sort keys of the query
+    """
+    file_id, sort_key = row[-2:]
+    if isinstance(sort_key, str):
+        sort_key = nocaseKey(sort_key)
+    return sort_key, file_id
+
+
+def findFilesPage(con, search_query, sort_column: int = -1, descending: bool = False,
+                  after: tuple = None, limit: int = SEARCH_PAGE_SIZE, cancelled=None) -> tuple:
+    """
+    :param con: connection, the default one if None
+    :param search_query: SearchQuery
+    :param sort_column: column of HEADER_SEARCH_RESULTS_TABLE, -1 to keep the order of indexing
+    :param descending:
+    :param after: keyset returned with the previous page, None for the first page
+    :param limit: results in page, -1 for all of them
+    :param cancelled: function returning True when the search is no more needed, checked between steps
+    :return: (results, after), after is None when there are no more results
+    search for a query, one page of results
+    the page starts after the (sort key, id) of the last row of the previous page, so it is found by
+    the same query whatever its position is, without skipping the rows of previous pages
+    files are searched in steps of ids, the best rows of each step are merged, a cancelled search
+    stops after the running step and returns the rows found so far
+    """
+    key = SEARCH_SORT_KEYS[sort_column] if 0 <= sort_column < len(SEARCH_SORT_KEYS) else None
+    search_index = searchIndexUsable(con)
+    order = 'desc' if descending else 'asc'
+    compare = '<' if descending else '>'
+    start = None
+    clauses, after_values = '', []
+    if after is not None:
+        if key:
+            clauses += f"and ({key}, f.id) {compare} (?, ?) "
+            after_values = list(after)
+        else:
+            clauses += f"and f.id {compare} ? "
+            after_values = [after[1]]
+            start = after[1]
+    ordering = f"order by {key} {order}, f.id {order} " if key else f"order by f.id {order} "
+    rows = []
+    for step in fileIdSteps(con, descending, start):
+        if cancelled is not None and cancelled():
+            break
+        sql, values = search_query.compile(search_index, step)
+        sql += clauses
+        values += after_values
+        if key and 0 <= limit <= len(rows):
+            # when the page is full, only rows before its last one can be in it
+            sql += f"and ({key}, f.id) {'>' if descending else '<'} (?, ?) "
+            values += [rows[-1][-1], rows[-1][-2]]
+        sql = f"select {SEARCH_RESULT_COLUMNS}, f.id, {key or 'null'} as sort_key {sql}{ordering}limit ?"
+        if key and limit < 0:
+            # all the rows are sorted once, after the last step
+            rows += searchRows(con, sql, values + [limit])
+        elif key:
+            rows = sorted(rows + searchRows(con, sql, values + [limit]), key=sortKey, reverse=descending)
+            del rows[limit:]
+        else:
+            # steps follow the order of ids, the first rows found are the page
+            rows += searchRows(con, sql, values + [limit - len(rows) if limit >= 0 else -1])
+            if 0 <= limit <= len(rows):
+                break
+    if key and limit < 0:
+        rows.sort(key=sortKey, reverse=descending)
+    # a missing extension or drive is shown empty
+    results = [[directory, filename, size, extension or '', label or '']
+               for directory, filename, size, extension, label, file_id, sort_key in rows]
+    # a negative limit returns all results
+    if len(rows) < limit or limit < 0:
+        return results, None
+    file_id, sort_key = rows[-1][-2:]
+    return results, (sort_key, file_id)
+
+
+def countFoundFiles(con, search_query, limit: int = SEARCH_COUNT_LIMIT, cancelled=None) -> int:
+    """
+    :param con: connection, the default one if None
+    :param search_query: SearchQuery
+    :param limit:
+    :param cancelled: function returning True when the count is no more needed, checked between steps
+    :return: number of results of a search, at most limit
+    """
+    search_index = searchIndexUsable(con)
+    count = 0
+    for step in fileIdSteps(con):
+        if count >= limit or (cancelled is not None and cancelled()):
+            break
+        sql, values = search_query.compile(search_index, step)
+        count += searchRows(con, f"select count(*) from (select 1 {sql}limit ?)", values + [limit - count])[0][0]
+    return count
+
+
+# content hashes of files, used while size and mtime of the file are the same as when they were computed
+# hashes of files on unmounted drives are kept, they are compared with the others
+HASH_COMMANDS = [
+    'CREATE TABLE IF NOT EXISTS file_hashes('
+    '   file_id INTEGER PRIMARY KEY, '
+    '   size INTEGER NOT NULL, '
+    '   mtime INTEGER, '
+    '   partial_hash TEXT, '
+    '   full_hash TEXT)',
+]
+
+
+def duplicateCandidates(con) -> list:
+    """
+    :param con: connection
+    :return: [[id, dir, filename, size, mtime, extension, label, drive_id, active, partial_hash, full_hash], ...]
+    or None if the files could not be read
+    files having the same size as other files, largest first, with their cached hashes still valid
+    empty files are not compared
+    """
+    query = QtSql.QSqlQuery(con)
+    query.setForwardOnly(True)
+    if not query.exec(
+            "SELECT f.id, di.path, f.filename, f.size, f.mtime, ifnull(e.extension, ''), ifnull(d.label, ''), "
+            "   fo.drive_id, ifnull(d.active, 0), h.partial_hash, h.full_hash "
+            "FROM files f "
+            "   JOIN directories di ON di.id=f.dir_id "
+            "   LEFT JOIN extensions e ON e.id=f.extension_id "
+            "   LEFT JOIN folders fo ON fo.id=f.folder_id "
+            "   LEFT JOIN drives d ON d.serial=fo.drive_id "
+            "   LEFT JOIN file_hashes h ON h.file_id=f.id AND h.size=f.size AND h.mtime IS f.mtime "
+            "WHERE f.size IN (SELECT size FROM files WHERE size > 0 GROUP BY size HAVING COUNT(*) > 1) "
+            "ORDER BY f.size DESC, f.id"):
+        printQueryErr(query, 'duplicateCandidates')
+        return None
+    candidates = []
+    columns = query.record().count()
+    while query.next():
+        # QtSql reads NULL as an empty string, a missing hash or mtime is kept as None
+        candidates.append([None if query.isNull(column) else query.value(column) for column in range(columns)])
+    query.clear()
+    return candidates
+
+
+def saveFileHashes(con, hashes: list) -> bool:
+    """
+    :param con: connection
+    :param hashes: [(file_id, size, mtime, partial_hash, full_hash), ...]
+    :return:
+    """
+    con.transaction()
+    query = QtSql.QSqlQuery(con)
+    query.prepare("INSERT OR REPLACE INTO file_hashes (file_id, size, mtime, partial_hash, full_hash) "
+                  "VALUES (?, ?, ?, ?, ?)")
+    for values in hashes:
+        for value in values:
+            query.addBindValue(value)
+        if not query.exec():
+            printQueryErr(query, 'saveFileHashes')
+            con.rollback()
+            return False
+    query.clear()
+    return con.commit()
+
+
+def removeStaleHashes(con) -> bool:
+    """
+    :param con: connection
+    :return:
+    remove hashes of files not indexed anymore or changed since
+    """
+    query = QtSql.QSqlQuery(con)
+    if not query.exec("DELETE FROM file_hashes WHERE NOT EXISTS ("
+                      "   SELECT 1 FROM files f "
+                      "   WHERE f.id=file_hashes.file_id AND f.size=file_hashes.size AND f.mtime IS file_hashes.mtime)"):
+        printQueryErr(query, 'removeStaleHashes')
+        return False
+    query.clear()
+    return True
+
+
+def duplicateGroupsQuery(partition: list, condition: str = '1') -> str:
+    """
+    :param partition: columns of files having the same values in each group of duplicates
+    :param condition: condition of the compared files, on columns of files which are not in partition
+    :return: select of (id, group_id) of the files having duplicates, group_id is the smallest id of the group
+    the groups are counted in a single pass over idx_files_size_filename_folder, then the ids of their files
+    are found by the same index, the rows of files are read only by the query using the ids
+    empty files are not compared
+    """
+    columns = ', '.join(partition)
+    join = ' AND '.join(f'f.{column}=g.{column}' for column in partition)
+    return f"SELECT f.id, g.group_id FROM (" \
+           f"   SELECT {columns}, MIN(id) AS group_id FROM files " \
+           f"   WHERE size > 0 AND {condition} GROUP BY {columns} HAVING COUNT(*) > 1) g " \
+           f"JOIN files f ON {join} AND {condition}"
+
+
+def findDuplicatesBySize(con=None):
+    """
+    :param con: connection, the default one if None
+    :return: ([[dir, filename, size, extension, label, 0], ...], [group, ...])
+    files of mounted drives having the same filename and size, largest first, and the group of each row
+    """
+    query = QtSql.QSqlQuery(con) if con is not None else QtSql.QSqlQuery()
+    query.setForwardOnly(True)
+    groups_sql = duplicateGroupsQuery(['size', 'filename'],
+                                      'folder_id IN (SELECT fo.id FROM folders fo '
+                                      '   JOIN drives d ON d.serial=fo.drive_id WHERE d.active=1)')
+    if not query.exec(
+            "SELECT di.path, f.filename, f.size, ifnull(e.extension, ''), ifnull(d.label, ''), dup.group_id "
+            "FROM (%s) dup "
+            "   JOIN files f ON f.id=dup.id "
+            "   JOIN directories di ON di.id=f.dir_id "
+            "   LEFT JOIN extensions e ON e.id=f.extension_id "
+            "   LEFT JOIN folders fo ON fo.id=f.folder_id "
+            "   LEFT JOIN drives d ON d.serial=fo.drive_id "
+            "ORDER BY f.size DESC, dup.group_id" % groups_sql):
+        printQueryErr(query, 'findDuplicatesBySize')
+        return [], []
+    results, groups = [], []
+    while query.next():
+        results.append([query.value(0), query.value(1), query.value(2), query.value(3), query.value(4), 0])
+        groups.append(query.value(5))
+    query.clear()
+    return results, groups
 
 
 def setDrivesActive(drives: list) -> None:
@@ -551,10 +925,7 @@ def removeExtensions(extensions: list) -> bool:
     exts_id = extensionsToInt(extensions)
     # clear indexed files with extension
     placeholder = ','.join("?" * len(exts_id))
-    query.prepare('DELETE FROM files WHERE extension_id IN (%s)' % placeholder)
-    for binder in exts_id:
-        query.addBindValue(str(binder))
-    if query.exec():
+    if deleteIndexed(['files'], 'extension_id IN (%s)' % placeholder, [str(binder) for binder in exts_id]):
         # delete extension itself
         query.prepare('DELETE FROM extensions WHERE id IN (%s)' % placeholder)
         for binder in exts_id:
@@ -680,6 +1051,21 @@ def isDriveActiveByLabel(label: str) -> bool:
     return False
 
 
+def activeDriveLabels() -> set:
+    """
+    :return: labels of the mounted drives
+    """
+    labels = set()
+    query = QtSql.QSqlQuery()
+    if query.exec("SELECT label FROM drives WHERE active=1"):
+        while query.next():
+            labels.add(query.value(0))
+    else:
+        printQueryErr(query, 'activeDriveLabels')
+    query.clear()
+    return labels
+
+
 def getCategoryId(category):
     query = QtSql.QSqlQuery()
     query.prepare("SELECT id FROM categories WHERE category=:category")
@@ -693,8 +1079,9 @@ def getCategoryId(category):
 def dummyDataResult():
     results = []
     term = 'index'
-    query = QtSql.QSqlQuery("select dir, filename, size, extension_id, folder_id from files "
-                            "where filename like '%index%'")
+    query = QtSql.QSqlQuery("select di.path as dir, f.filename, f.size, f.extension_id, f.folder_id from files f "
+                            "join directories di on di.id=f.dir_id "
+                            "where f.filename like '%index%'")
     while query.next():
         item = [
             query.value('dir'),
@@ -751,77 +1138,107 @@ def getPreferenceNameById(id):
 
 def countFiles():
     query = QtSql.QSqlQuery()
-    query.prepare("SELECT COUNT(id) FROM files")
+    query.prepare("SELECT ifnull(SUM(files), 0) FROM file_stats")
     if query.exec():
         while query.first():
             return query.value(0)
 
 
+# return list with files for each extension, from statistics
+# [[category, extension, files, bytes], ...]
 def getUsedExtensions():
     result = []
     query = QtSql.QSqlQuery()
     query.prepare("SELECT c.category, coalesce(e.extension, 'no_extension') AS extension, "
-                  "SUM(CASE WHEN f.extension_id is null THEN 1 ELSE 0 END) AS [no_extension], "
-                  "COUNT(f.extension_id) AS [with_extension] "
-                  "FROM files f "
-                  "LEFT JOIN extensions e ON f.extension_id=e.id "
+                  "SUM(s.files) AS files, SUM(s.bytes) AS bytes "
+                  "FROM file_stats s "
+                  "LEFT JOIN extensions e ON s.extension_id=e.id "
                   "LEFT JOIN categories c ON e.category_id=c.id "
-                  "GROUP BY extension_id ORDER BY with_extension DESC")
+                  "GROUP BY s.extension_id HAVING files > 0 ORDER BY files DESC")
     if query.exec():
         while query.next():
-            if query.value('with_extension') != 0:
-                result.append([query.value('category'), query.value('extension'), query.value('with_extension')])
-            else:
-                result.append([query.value('category'), query.value('extension'), query.value('no_extension')])
+            result.append([query.value('category'), query.value('extension'), query.value('files'),
+                           query.value('bytes')])
         query.clear()
     return result
 
 
-# return list with files for each category
-# [[category, files], [category, files]]
+# return list with files for each category, from statistics
+# [[category, files, bytes], [category, files, bytes]]
 def categoryAndFiles():
     result = []
     query = QtSql.QSqlQuery()
-    query.prepare("SELECT c.category, COUNT(f.extension_id) as files "
-                  "FROM files f "
-                  "LEFT JOIN extensions e ON f.extension_id=e.id "
-                  "LEFT JOIN categories c ON e.category_id=c.id "
-                  "WHERE e.category_id NOT NULL "
-                  "GROUP BY category ORDER BY category ASC")
+    query.prepare("SELECT c.category, SUM(s.files) as files, SUM(s.bytes) as bytes "
+                  "FROM file_stats s "
+                  "JOIN extensions e ON s.extension_id=e.id "
+                  "JOIN categories c ON e.category_id=c.id "
+                  "GROUP BY category HAVING files > 0 ORDER BY category ASC")
     if query.exec():
         while query.next():
-            result.append([query.value('category'), query.value('files')])
+            result.append([query.value('category'), query.value('files'), query.value('bytes')])
         query.clear()
     return result
 
 
+# return list with files for each drive, from statistics
+# [[drive, files, bytes, active, size], ...]
 def filesOnDrive():
     result = []
     query = QtSql.QSqlQuery()
-    query.prepare("SELECT d.label as drive, COUNT(f.id) as filesOnDrive, d.active, d.size "
-                  "FROM files f "
-                  "LEFT JOIN folders fo ON f.folder_id=fo.id "
+    query.prepare("SELECT d.label as drive, SUM(s.files) as filesOnDrive, SUM(s.bytes) as bytes, d.active, d.size "
+                  "FROM file_stats s "
+                  "LEFT JOIN folders fo ON s.folder_id=fo.id "
                   "LEFT JOIN drives d on d.serial=fo.drive_id "
-                  "GROUP BY fo.drive_id "
+                  "GROUP BY fo.drive_id HAVING filesOnDrive > 0 "
                   "ORDER BY filesOnDrive DESC")
     if query.exec():
         while query.next():
-            result.append(
-                [query.value('drive'), query.value('filesOnDrive'), query.value('active'), query.value('size')])
+            result.append([query.value('drive'), query.value('filesOnDrive'), query.value('bytes'),
+                           query.value('active'), query.value('size')])
         query.clear()
     return result
 
 
-def connection(name: str):
+def connection(name: str, profile: str = 'interactive'):
     """
-    :param name:
-    :return:
+    :param name: name of the connection
+    :param profile: one of CONNECTION_PROFILES
+    :return: the opened connection
     """
     db = QtSql.QSqlDatabase.addDatabase(DATABASE_DRIVER, name)
     db.setDatabaseName(getDatabaseLocation())
+    openConnection(db, profile)
     return db
 
 
+def removeConnection(name: str):
+    """
+    :param name: name of a closed connection
+    forget the connection, so the name can be used again
+    called after the QSqlDatabase and the queries of connection are deleted, else Qt warns it is still in use
+    """
+    QtSql.QSqlDatabase.removeDatabase(name)
+
+
+def openConnection(db, profile: str) -> bool:
+    """
+    :param db:
+    :param profile: one of CONNECTION_PROFILES
+    :return:
+    open the connection and apply the settings of profile
+    """
+    settings = CONNECTION_PROFILES[profile]
+    db.setConnectOptions(f"QSQLITE_BUSY_TIMEOUT={settings['busy_timeout']}")
+    if not db.open():
+        return False
+    query = QtSql.QSqlQuery(db)
+    for pragma in settings['pragmas']:
+        if not query.exec(f"PRAGMA {pragma}"):
+            printQueryErr(query, 'openConnection')
+    query.clear()
+    return True
+
+
 class GDatabase:
     def __init__(self):
         super().__init__()
@@ -837,9 +1254,11 @@ class GDatabase:
         self.default_extensions = default_extensions
         self.checkDatabaseConnection()
         self.tablesExists()
+        self.migrate()
+        self.addMissingPreferences()
 
     def checkDatabaseConnection(self):
-        if not self.con.open():
+        if not openConnection(self.con, 'interactive'):
             QtWidgets.QMessageBox.critical(
                 None, 'DB Connection Error',
                 'Could not open database: '
@@ -852,6 +1271,182 @@ class GDatabase:
         if missing_tables:
             self.addTablesDatabase()
 
+    def addMissingPreferences(self):
+        """
+        preferences added in newer versions are inserted with their default values
+        in databases created by an older version
+        """
+        existing = getAll('preferences', ['name'])
+        query = QtSql.QSqlQuery()
+        for preference in self.preferences:
+            if preference[0] in existing:
+                continue
+            query.prepare("""INSERT INTO preferences (name, description, value, 
+            original, type, editable) VALUES (?, ?, ?, ?, ?, ?)""")
+            for binder in preference:
+                query.addBindValue(binder)
+            if not query.exec():
+                printQueryErr(query, 'addMissingPreferences')
+        query.clear()
+
+    def migrations(self):
+        """
+        each migration returns the commands bringing the database to the next version,
+        the version is saved as PRAGMA user_version
+        a migration is never changed once released, a schema change is added as a new migration at the end
+        """
+        return [self.migrationIncrementalReindex, self.migrationSecondaryIndexes, self.migrationSearchIndex,
+                self.migrationDirectoryIds, self.migrationStatistics, self.migrationFileHashes,
+                self.migrationDuplicatesIndex]
+
+    def migrationIncrementalReindex(self):
+        """ mtime of files and the indexed directories, used by incremental reindex """
+        commands = []
+        if 'mtime' not in tables_columns('files'):
+            commands.append('ALTER TABLE files ADD COLUMN mtime INTEGER DEFAULT NULL')
+        commands += [
+            'CREATE TABLE IF NOT EXISTS directories('
+            '   id INTEGER PRIMARY KEY, '
+            '   folder_id INTEGER NOT NULL, '
+            '   path TEXT NOT NULL, '
+            '   mtime INTEGER DEFAULT NULL, '
+            '   UNIQUE(folder_id, path), '
+            '   FOREIGN KEY(folder_id) REFERENCES folders(id))',
+            'CREATE INDEX IF NOT EXISTS idx_files_folder_dir ON files(folder_id, dir)',
+        ]
+        return commands
+
+    def migrationSecondaryIndexes(self):
+        """
+        indexes for lookups of folders, drives and extensions, and for duplicates grouping
+        files by folder_id use idx_files_folder_dir
+        """
+        return [
+            'CREATE INDEX IF NOT EXISTS idx_files_extension ON files(extension_id)',
+            'CREATE INDEX IF NOT EXISTS idx_files_size_filename ON files(size, filename)',
+            'CREATE INDEX IF NOT EXISTS idx_folders_path ON folders(path)',
+            'CREATE INDEX IF NOT EXISTS idx_drives_label ON drives(label)',
+        ]
+
+    def migrationSearchIndex(self):
+        """
+        full text index of files, used by search for substring search
+        the trigram tokenizer needs SQLite 3.34, with an older one search keeps using LIKE
+        """
+        if not searchIndexSupported():
+            print("FTS5 trigram tokenizer is not available, search will not use an index")
+            return []
+        return [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+            "   dir, filename, content='files', content_rowid='id', tokenize='trigram')",
+            "INSERT INTO files_fts(files_fts) VALUES('rebuild')",
+        ]
+
+    def migrationDirectoryIds(self):
+        """
+        the path of a directory is saved once in directories, files keep only its id
+        directories of files indexed before and their parents up to the folder are added, not indexed yet
+        files table is created again without dir, keeping the ids of files
+        the search index is split in filename of files and path of directories
+        """
+        # parent path of a directory, the text after its last slash and the slash are removed
+        def parentPath(column):
+            return f"rtrim(rtrim({column}, replace({column}, '/', '')), '/')"
+
+        commands = [
+            'ALTER TABLE directories ADD COLUMN parent_id INTEGER DEFAULT NULL REFERENCES directories(id)',
+            'INSERT OR IGNORE INTO directories (folder_id, path) SELECT DISTINCT folder_id, dir FROM files',
+            'INSERT OR IGNORE INTO directories (folder_id, path) '
+            '   SELECT id, path FROM folders WHERE id IN (SELECT folder_id FROM directories)',
+            'WITH RECURSIVE parents(folder_id, path) AS ('
+            '   SELECT folder_id, path FROM directories '
+            '   UNION '
+            f'  SELECT p.folder_id, {parentPath("p.path")} FROM parents p '
+            '   JOIN folders fo ON fo.id = p.folder_id '
+            f'  WHERE length({parentPath("p.path")}) > length(fo.path) '
+            '   AND substr(p.path, 1, length(fo.path)) = fo.path) '
+            'INSERT OR IGNORE INTO directories (folder_id, path) SELECT folder_id, path FROM parents',
+            # a root as 'C:/' or '/' is its own parent path, it is left without parent
+            'UPDATE directories SET parent_id = (SELECT p.id FROM directories p '
+            '   WHERE p.folder_id = directories.folder_id AND p.id <> directories.id '
+            f'  AND p.path IN ({parentPath("directories.path")}, {parentPath("directories.path")} || \'/\'))',
+            'CREATE TABLE files_normalized('
+            '   id INTEGER PRIMARY KEY, '
+            '   dir_id INTEGER NOT NULL, '
+            '   filename TEXT NOT NULL, '
+            '   size INTEGER, '
+            '   mtime INTEGER DEFAULT NULL, '
+            '   extension_id INTEGER DEFAULT NULL, '
+            '   folder_id INTEGER NOT NULL, '
+            '   FOREIGN KEY(dir_id) REFERENCES directories(id), '
+            '   FOREIGN KEY(extension_id) REFERENCES extensions(id), '
+            '   FOREIGN KEY(folder_id) REFERENCES folders(id))',
+            'INSERT INTO files_normalized (id, dir_id, filename, size, mtime, extension_id, folder_id) '
+            '   SELECT f.id, d.id, f.filename, f.size, f.mtime, f.extension_id, f.folder_id FROM files f '
+            '   JOIN directories d ON d.folder_id = f.folder_id AND d.path = f.dir',
+            'DROP TABLE IF EXISTS files_fts',
+            'DROP TABLE files',
+            'ALTER TABLE files_normalized RENAME TO files',
+            'CREATE INDEX IF NOT EXISTS idx_files_folder ON files(folder_id)',
+            'CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir_id)',
+            'CREATE INDEX IF NOT EXISTS idx_files_extension ON files(extension_id)',
+            'CREATE INDEX IF NOT EXISTS idx_files_size_filename ON files(size, filename)',
+        ]
+        if searchIndexSupported():
+            commands += SEARCH_INDEX_COMMANDS + SEARCH_INDEX_REBUILD
+        return commands
+
+    def migrationStatistics(self):
+        """ statistics of files by folder and extension, counted once from the indexed files """
+        return STATISTICS_COMMANDS + [statisticsStatement('1')]
+
+    def migrationFileHashes(self):
+        """ content hashes of files, computed when duplicates are searched """
+        return HASH_COMMANDS
+
+    def migrationDuplicatesIndex(self):
+        """
+        duplicates are grouped by an index covering size, filename and folder,
+        so groups are counted without reading the rows of files
+        """
+        return [
+            'CREATE INDEX IF NOT EXISTS idx_files_size_filename_folder ON files(size, filename, folder_id)',
+            'DROP INDEX IF EXISTS idx_files_size_filename',
+        ]
+
+    def schemaVersion(self):
+        query = QtSql.QSqlQuery("PRAGMA user_version")
+        version = query.value(0) if query.first() else 0
+        query.clear()
+        return version
+
+    def migrate(self):
+        """
+        run the migrations newer than the version of database, each one in its own transaction
+        indexed data is kept, then the statistics used by the query planner are updated
+        and the space freed by migrations is returned to the file system
+        """
+        version = self.schemaVersion()
+        migrations = self.migrations()
+        if version >= len(migrations):
+            return
+        query = QtSql.QSqlQuery()
+        for number, migration in enumerate(migrations[version:], version + 1):
+            self.con.transaction()
+            for command in migration() + [f'PRAGMA user_version = {number}']:
+                if not query.exec(command):
+                    printQueryErr(query, migration.__name__)
+                    self.con.rollback()
+                    QtWidgets.QMessageBox.critical(
+                        None, 'DB Migration Error',
+                        f'Could not upgrade database to version {number}: '
+                        f'{query.lastError().databaseText()}')
+                    sys.exit(1)
+            self.con.commit()
+        query.exec('ANALYZE')
+        query.exec('VACUUM')
+        query.clear()
+
     def addTablesDatabase(self):
         query = QtSql.QSqlQuery()
         commands = [
@@ -862,7 +1457,14 @@ class GDatabase:
             'DROP TABLE IF EXISTS folders',
             'DROP TABLE IF EXISTS extensions',
             'DROP TABLE IF EXISTS files',
+            'DROP TABLE IF EXISTS files_fts',
+            'DROP TABLE IF EXISTS directories_fts',
+            'DROP TABLE IF EXISTS directories',
+            'DROP TABLE IF EXISTS file_stats',
+            'DROP TABLE IF EXISTS file_hashes',
             'DROP TABLE IF EXISTS preferences',
+            # new tables start from the first version, migrations bring them to the last one
+            'PRAGMA user_version = 0',
 
             'CREATE TABLE categories('
             '   id INTEGER PRIMARY KEY, '
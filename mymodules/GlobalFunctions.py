@@ -20,6 +20,24 @@ APP_NAME = 'Drives Indexer'
 DATABASE_NAME = 'drives-indexer.sqlite'
 DATABASE_DRIVER = 'QSQLITE'
 
+# settings of database connections, by the work done with them
+# in WAL mode, searches read a consistent snapshot while the indexer writes
+# busy_timeout is in milliseconds, negative cache_size is in KiB
+CONNECTION_PROFILES = {
+    'bulk-index': {'busy_timeout': 30000,
+                   'pragmas': ['journal_mode=WAL', 'synchronous=NORMAL', 'cache_size=-65536', 'temp_store=MEMORY']},
+    'interactive': {'busy_timeout': 5000,
+                    'pragmas': ['journal_mode=WAL', 'synchronous=NORMAL', 'cache_size=-16384',
+                                'mmap_size=268435456']},
+    'read-only': {'busy_timeout': 5000,
+                  'pragmas': ['cache_size=-16384', 'mmap_size=268435456', 'query_only=1']},
+}
+
+# search while typing starts when typing pauses for this many milliseconds,
+# and when the query has a filter or a term of this length at least
+SEARCH_TYPING_DELAY = 150
+SEARCH_TYPING_MIN_LENGTH = 3
+
 CSV_COLUMN_SEPARATOR = ','
 CSV_LINE_SEPARATOR = '\n'
 REQUIRED_TABLES = {'drives', 'folders', 'extensions', 'files', 'categories', 'preferences'}
@@ -76,7 +94,11 @@ PREFERENCES = [
     ['index_all_types_of_files', 'Index any types of files', '0', '0', 'bool', '1'],
     ['index_files_without_extension', 'Index files without extension', '1', '1', 'bool', '1'],
     ['index_hidden_content', 'Index hidden content', '0', '0', 'bool', '1'],
+    ['exact_progress_count', 'Count files before indexing for exact progress', '0', '0', 'bool', '1'],
+    ['incremental_reindex', 'Reindex only the changes in folders', '1', '1', 'bool', '1'],
+    ['search_as_you_type', 'Search while the term is typed', '1', '1', 'bool', '1'],
     ['forbidden_folders', 'Forbidden Folders', 'tmp,temp,cache', 'tmp,temp,cache', 'list', '0'],
+    ['index_batch_size', 'Files saved in one transaction while indexing', '5000', '5000', 'int', '0'],
     ['window_size', 'Dimension for window when start (width, height)', '1000, 800', '1000, 800', 'str', '0'],
     ['settings_tabs_order', 'Preferred order for settings tabs', 'Folders,Drives,Categories,Extensions,Preferences,Reports',
      'Folders,Drives,Categories,Extensions,Preferences,Reports', 'str', '0'],
@@ -333,7 +355,11 @@ def getHelp(category):
 
         'duplicates': "<!DOCTYPE html><html><body><h1>Duplicates</h1><p>In the Duplicates tab, you can find duplicates "
                       "from indexed files.</p><p>Press the 'Find' button. The duplicates will be identified based on "
-                      "the file size and the filename.<br><br>The table will be populated with found duplicated. In the "
+                      "their content, also when they have different names. Files with the same size are compared "
+                      "first by their start and end, then by their whole content. The files of different drives are "
+                      "read at the same time. The content hashes are saved, so the next searches read only the new or "
+                      "changed files. Files on unmounted drives are compared by the hashes saved while they were "
+                      "mounted.<br><br>The table will be populated with found duplicated. In the "
                       "last column, you can check the boxes for the duplicates you wish to remove. By default, there "
                       "will be a reference file which will not be checked and the next duplicates will be checked.<br>"
                       "After you selected the instances of the files which you wish to remove, you can export the list "
@@ -372,7 +398,8 @@ def getHelp(category):
                    " process, all operations which can affect the result will be blocked. You will not be able to " \
                    "add/remove folders, and also you will not be able to remove/add extensions.</p><p>If for any reason" \
                    " you need to stop the indexer while it is indexing, you will have to reindex the folder. In the " \
-                   "Status column a red exclamation sign will be shown!</p></body></html>",
+                   "Status column a red exclamation sign will be shown! The files found until the indexer was " \
+                   "stopped are kept, and the next index of the folder continues from there.</p></body></html>",
 
         'general': "<!DOCTYPE html><html><body><h1>General</h1><p>If you are like me and have a big collection of old " \
                    "drives where you keep all your history, documents, work, pictures, favorite music and movies, then " \
@@ -421,12 +448,32 @@ def getHelp(category):
                        "also files with those extensions, and the next index will avoid them.</p><p><ul><li>Index files " \
                        "without extension</li></ul>If is checked, the files without extensions will also be " \
                        "indexed.</p><p><ul><li>Index hidden content</li></ul>If is checked, the files and folders hidden " \
-                       "by system, will be scanned and indexed.</p></body></html>",
+                       "by system, will be scanned and indexed.</p><p><ul><li>Count files before indexing for exact " \
+                       "progress</li></ul>If is checked, the folders are walked once before indexing to count their " \
+                       "files, and the progress bar is exact. If is unchecked, the indexing starts immediately and the " \
+                       "progress is estimated from the previous index of the folders.</p><p><ul><li>Reindex only the " \
+                       "changes in folders</li></ul>If is checked, a reindex saves only the files added, changed or " \
+                       "removed since the last index, and the directories not modified since then are not read again. " \
+                       "Uncheck it to reindex everything, after changing the extensions or the hidden content " \
+                       "preference.</p></body></html>",
 
         'search': "<!DOCTYPE html><html><body><h1>Search</h1><p>In the Search tab you can find the files you want!</p><p>If " \
-                  "you have indexed your folders, enter your search term, press Enter, or click the Search button.</p><p>If " \
+                  "you have indexed your folders, enter your search term, press Enter, or click the Search button. The " \
+                  "results are also shown while you type, when you stop typing for a moment and the term has 3 " \
+                  "characters at least. Adding characters to the term filters the results already found, so they " \
+                  "are shown at once. Searching while typing can be turned off in Preferences. Enter searches again " \
+                  "in the database, with the files indexed meanwhile.</p><p>If " \
                   "you wish to search only for a specific category of files, you can uncheck the rest of categories.</p><p>" \
-                  "You can sort results as you wish, clicking on the table's header.</p><p>If some of the results belong to" \
+                  "The search text can have more terms, a file is found if it has all of them in its name or directory. " \
+                  "Write between double quotes a term with spaces, like \"summer holiday\". You can add filters to the " \
+                  "terms:</p><ul><li>ext:mkv,avi - files with one of the extensions</li><li>size:&gt;2GB - files bigger " \
+                  "than 2GB, you can use also &lt;, &gt;=, &lt;=, an exact size or a range like size:100MB..1GB</li><li>" \
+                  "drive:Archive03 - files on the drive with this label</li><li>path:/photos/2014 - files in directories " \
+                  "having this text</li><li>category:Videos - files with an extension of this category</li></ul><p>For " \
+                  "example: holiday ext:jpg size:&gt;2MB drive:Archive03</p><p>" \
+                  "You can sort results as you wish, clicking on the table's header.</p><p>The results are shown in pages, " \
+                  "the next ones are loaded when you scroll to the end of the table. Export of all results " \
+                  "includes also the pages not loaded yet.</p><p>If some of the results belong to" \
                   " a drive which is not mounted, the name of that drive will be red.</p><p>If the results belong to a " \
                   "mounted drive, with a double click on the table line you can quickly see information about each file. " \
                   "Many files also have preview.</p></body></html>"
@@ -0,0 +1,463 @@
+import abc
+import queue
+import threading
+import time
+
+from PyQt5 import QtCore, QtSql
+from PyQt5.QtCore import QObject, QRunnable, pyqtSlot
+
+from mymodules import GDBModule
+from mymodules.GDBModule import getPreferenceByName
+
+
+class FilesChanges(abc.ABC):
+    """
+    Changes of the indexed files and directories, each one is sent with add(name, values)
+    name is one of FilesWriter.STATEMENTS
+    """
+    # the directory of a file is saved as dir_id, found by folder_id and dir
+    COLUMNS = ['filename', 'size', 'mtime', 'extension_id', 'folder_id', 'dir']
+
+    @abc.abstractmethod
+    def add(self, name, values):
+        """ save the change name with the values of its statement, or send it to the writer """
+
+    def addFile(self, file):
+        """ the directory of the file must be registered before """
+        self.add('insert_file', [file[column] for column in self.COLUMNS])
+
+    def updateFile(self, file_id, file):
+        self.add('update_file', [file['size'], file['mtime'], file['extension_id'], file_id])
+
+    def deleteFile(self, file_id):
+        self.add('delete_file', [file_id])
+
+    def registerDirectory(self, folder_id, path):
+        """ a directory found but not indexed yet, it is saved without mtime """
+        # the parent of 'C:/x' is saved as 'C:/'
+        parent = path.rstrip('/').rpartition('/')[0]
+        self.add('register_directory', [folder_id, path, folder_id, parent, parent + '/'])
+
+    def saveDirectory(self, folder_id, path, mtime):
+        """ a directory with all its files indexed """
+        self.add('save_directory', [folder_id, path, mtime])
+
+    def removeDirectory(self, folder_id, path):
+        """ a directory not existing anymore, with its files """
+        self.add('remove_directory_files', [folder_id, path])
+        self.add('remove_directory', [folder_id, path])
+
+
+class FilesWriter(FilesChanges):
+    """
+    Buffered writer used by the writer thread
+    keeps a prepared statement for each kind of change and saves the collected changes in one transaction
+    when the batch is full or when flush_interval seconds passed since the last commit
+    """
+    # in a transaction the changes are saved in this order, files are inserted after their directories
+    STATEMENTS = {
+        'delete_file': "DELETE FROM files WHERE id=?",
+        'update_file': "UPDATE files SET size=?, mtime=?, extension_id=? WHERE id=?",
+        'remove_directory_files': "DELETE FROM files "
+                                  "WHERE dir_id=(SELECT id FROM directories WHERE folder_id=? AND path=?)",
+        'remove_directory': "DELETE FROM directories WHERE folder_id=? AND path=?",
+        'register_directory': "INSERT OR IGNORE INTO directories (folder_id, path, parent_id) VALUES (?, ?, "
+                              "(SELECT id FROM directories WHERE folder_id=? AND path IN (?, ?)))",
+        'save_directory': "INSERT INTO directories (folder_id, path, mtime) VALUES (?, ?, ?) "
+                          "ON CONFLICT(folder_id, path) DO UPDATE SET mtime=excluded.mtime",
+        'insert_file': "INSERT INTO files (dir_id, filename, size, mtime, extension_id, folder_id) "
+                       "SELECT id, ?, ?, ?, ?, folder_id FROM directories WHERE folder_id=? AND path=?",
+    }
+
+    # deleted rows are removed from the search index before, with the same values
+    SEARCH_INDEX_DELETE = {
+        'delete_file': ('files', "id=?"),
+        'remove_directory_files': ('files', "dir_id=(SELECT id FROM directories WHERE folder_id=? AND path=?)"),
+        'remove_directory': ('directories', "folder_id=? AND path=?"),
+    }
+    # inserted rows are added to the search index after the batch
+    SEARCH_INDEX_INSERT = {
+        'register_directory': 'directories',
+        'save_directory': 'directories',
+        'insert_file': 'files',
+    }
+    # changed files are removed from statistics before and added after, with the last values of the statement
+    # inserted files are added to statistics after the batch
+    STATISTICS_REMOVE = {
+        'delete_file': "id=?",
+        'update_file': "id=?",
+        'remove_directory_files': "dir_id=(SELECT id FROM directories WHERE folder_id=? AND path=?)",
+    }
+    STATISTICS_ADD = {
+        'update_file': "id=?",
+    }
+
+    def __init__(self, con, batch_size, flush_interval=2.0):
+        self.con = con
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.pending = {name: [] for name in self.STATEMENTS}
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+        self.search_index = GDBModule.searchIndexExists(self.con)
+        self.queries = {}
+        self.search_index_queries = {}
+        for name, statement in self.STATEMENTS.items():
+            self.queries[name] = self.prepare(statement)
+        if self.search_index:
+            for name, (table, condition) in self.SEARCH_INDEX_DELETE.items():
+                self.search_index_queries[name] = self.prepare(
+                    GDBModule.searchIndexStatement(GDBModule.SEARCH_INDEX_DELETE, table, condition))
+        self.statistics_queries = {}
+        for name, condition in self.STATISTICS_REMOVE.items():
+            self.statistics_queries[name, True] = self.prepare(GDBModule.statisticsStatement(condition, True))
+        for name, condition in self.STATISTICS_ADD.items():
+            self.statistics_queries[name, False] = self.prepare(GDBModule.statisticsStatement(condition))
+
+    def prepare(self, statement):
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare(statement)
+        return query
+
+    def execBatch(self, query, rows, name):
+        # execBatch binds a list of values for each placeholder
+        for column in zip(*rows):
+            query.addBindValue(list(column))
+        if query.execBatch():
+            return True
+        GDBModule.printQueryErr(query, f'FilesWriter.flush {name}')
+        return False
+
+    def lastId(self, table):
+        query = QtSql.QSqlQuery(self.con)
+        if query.exec(f"SELECT ifnull(max(id), 0) FROM {table}") and query.first():
+            return query.value(0)
+        return 0
+
+    def indexInsertedRows(self, table, last_id):
+        """ add to search index the rows inserted after last_id """
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare(GDBModule.searchIndexStatement(GDBModule.SEARCH_INDEX_INSERT, table))
+        query.addBindValue(last_id)
+        if query.exec():
+            return True
+        GDBModule.printQueryErr(query, 'FilesWriter.indexInsertedRows')
+        return False
+
+    def updateStatistics(self, name, rows, remove):
+        """ remove or add to statistics the files changed by a statement, for each of its rows """
+        query = self.statistics_queries.get((name, remove))
+        if query is None:
+            return True
+        placeholders = self.STATISTICS_REMOVE[name].count('?')
+        return self.execBatch(query, [row[-placeholders:] for row in rows], name)
+
+    def countInsertedFiles(self, last_id):
+        """ add to statistics the files inserted after last_id """
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare(GDBModule.statisticsStatement("id > ?"))
+        query.addBindValue(last_id)
+        if query.exec():
+            return True
+        GDBModule.printQueryErr(query, 'FilesWriter.countInsertedFiles')
+        return False
+
+    def add(self, name, values):
+        self.pending[name].append(values)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flushIfDue(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        write pending changes in a single transaction
+        if something goes wrong, the whole batch is rolled back
+        """
+        self.last_flush = time.monotonic()
+        if not self.pending_count:
+            return True
+        pending = self.pending
+        self.pending = {name: [] for name in self.STATEMENTS}
+        self.pending_count = 0
+        # the write lock is taken when the transaction begins, waiting for other connections
+        begin = QtSql.QSqlQuery(self.con)
+        if not begin.exec("BEGIN IMMEDIATE"):
+            GDBModule.printQueryErr(begin, 'FilesWriter.flush')
+            return False
+        # last id of each table before its inserts, taken after its deletes because ids can be reused
+        last_ids = {}
+        for name, rows in pending.items():
+            if not rows:
+                continue
+            saved = True
+            if name in self.search_index_queries:
+                saved = self.execBatch(self.search_index_queries[name], rows, name)
+            table = self.SEARCH_INDEX_INSERT.get(name)
+            if table and table not in last_ids:
+                last_ids[table] = self.lastId(table)
+            if not (saved and self.updateStatistics(name, rows, True) and self.execBatch(self.queries[name], rows, name)
+                    and self.updateStatistics(name, rows, False)):
+                self.con.rollback()
+                return False
+        for table, last_id in last_ids.items():
+            if self.search_index and not self.indexInsertedRows(table, last_id):
+                self.con.rollback()
+                return False
+        if 'files' in last_ids and not self.countInsertedFiles(last_ids['files']):
+            self.con.rollback()
+            return False
+        if self.con.commit():
+            return True
+        print(f"Could not commit transaction: {self.con.lastError().text()}")
+        self.con.rollback()
+        return False
+
+
+class PipelineStatistics:
+    """
+    Counters of the indexing pipeline
+    walkers waiting for a full queue mean the writer is slower,
+    a writer waiting for an empty queue means the walkers are slower
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.sent_changes = 0
+        self.back_pressure_waits = 0
+        self.back_pressure_time = 0.0
+        self.written_changes = 0
+        self.write_time = 0.0
+        self.idle_time = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def changesSent(self, count, waited=None):
+        with self.lock:
+            self.sent_changes += count
+            if waited is not None:
+                self.back_pressure_waits += 1
+                self.back_pressure_time += waited
+
+    def changesWritten(self, count, queue_depth):
+        self.written_changes += count
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def asDict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'back_pressure_waits': self.back_pressure_waits,
+            'back_pressure_seconds': round(self.back_pressure_time, 2),
+            'writer_idle_seconds': round(self.idle_time, 2),
+            'walked_changes': self.sent_changes,
+            'walking_rate': int(self.sent_changes / elapsed),
+            'written_changes': self.written_changes,
+            'writing_rate': int(self.written_changes / max(self.write_time, 1e-6)),
+        }
+
+
+class WriterChannel(FilesChanges):
+    """
+    Used by a walker to send its changes to the IndexWriter
+    changes are sent in chunks, the walker waits only when the queue of the writer is full
+    """
+    CHUNK_SIZE = 1000
+    SEND_INTERVAL = 0.5
+
+    def __init__(self, index_writer):
+        self.index_writer = index_writer
+        self.chunk = []
+        self.last_send = time.monotonic()
+
+    def add(self, name, values):
+        self.chunk.append((name, values))
+        if len(self.chunk) >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flushIfDue(self):
+        if self.chunk and time.monotonic() - self.last_send >= self.SEND_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """ send the collected changes, they are saved by the writer thread """
+        self.last_send = time.monotonic()
+        if self.chunk:
+            chunk = self.chunk
+            self.chunk = []
+            self.index_writer.put(('changes', chunk, None))
+
+    def send(self, method, *args):
+        """ run a method of the writer after the changes sent until now, without waiting for it """
+        self.flush()
+        self.index_writer.put((method, args, None))
+
+    def request(self, method, *args):
+        """ run a method of the writer after the changes sent until now, and return its result """
+        self.flush()
+        reply = {'done': threading.Event(), 'result': None}
+        self.index_writer.put((method, args, reply))
+        reply['done'].wait()
+        return reply['result']
+
+
+class IndexWriterSignals(QObject):
+    finished = QtCore.pyqtSignal()
+
+
+class IndexWriter(QRunnable):
+    """
+    Single writer of the indexing pipeline
+    it owns the indexer_connection and saves in batches the changes received from the walkers
+    through a bounded queue, so walking and writing are done at the same time
+    """
+
+    def __init__(self, queue_size=64, connection_name='indexer_connection'):
+        super().__init__()
+        self.signals = IndexWriterSignals()
+        self.connection_name = connection_name
+        self.queue = queue.Queue(queue_size)
+        self.statistics = PipelineStatistics()
+        self.batch_size = getPreferenceByName('index_batch_size')
+        self.done = threading.Event()
+        self.con = None
+        self.files_writer = None
+
+    def put(self, item):
+        """ called by walkers, it blocks while the queue is full """
+        try:
+            self.queue.put_nowait(item)
+            waited = None
+        except queue.Full:
+            start = time.monotonic()
+            self.queue.put(item)
+            waited = time.monotonic() - start
+        if item[0] == 'changes':
+            self.statistics.changesSent(len(item[1]), waited)
+
+    def stop(self):
+        """ the writer ends after saving everything sent until now """
+        self.queue.put(None)
+
+    def finish(self):
+        """ stop and wait for the writer to end """
+        self.stop()
+        self.done.wait()
+
+    @pyqtSlot()
+    def run(self):
+        self.con = GDBModule.connection(self.connection_name, 'bulk-index')
+        self.files_writer = FilesWriter(self.con, self.batch_size)
+        try:
+            while True:
+                start = time.monotonic()
+                try:
+                    item = self.queue.get(timeout=self.files_writer.flush_interval)
+                except queue.Empty:
+                    item = False
+                waited = time.monotonic()
+                self.statistics.idle_time += waited - start
+                if item is None:
+                    break
+                if item:
+                    self.processSafely(self.process, *item)
+                else:
+                    self.processSafely(self.files_writer.flushIfDue)
+                self.statistics.write_time += time.monotonic() - waited
+            self.processSafely(self.files_writer.flush)
+        finally:
+            self.files_writer = None
+            self.con.close()
+            self.con = None
+            GDBModule.removeConnection(self.connection_name)
+            self.done.set()
+            self.signals.finished.emit()
+
+    def processSafely(self, action, *args):
+        """
+        :param action: process, or a flush of files_writer
+        :param args:
+        a failed action is printed and skipped, the writer goes on with the next item of queue,
+        so the walkers sending to the queue or waiting for a reply are never blocked by a dead writer
+        """
+        try:
+            action(*args)
+        except Exception as e:
+            print(f"Index writer error in {action.__name__} {args[:1]}: {str(e)}")
+            # a batch failed in the middle is not left open
+            if self.con.isOpen():
+                self.con.rollback()
+
+    def process(self, method, args, reply):
+        if method == 'changes':
+            for name, values in args:
+                self.files_writer.add(name, values)
+            self.files_writer.flushIfDue()
+            self.statistics.changesWritten(len(args), self.queue.qsize())
+            return
+        result = None
+        try:
+            # other methods see all the changes received before them
+            self.files_writer.flush()
+            result = getattr(self, method)(*args)
+        finally:
+            # the walker waiting for the result is released also if the method failed
+            if reply is not None:
+                reply['result'] = result
+                reply['done'].set()
+
+    def setStatusFolder(self, path, status):
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare("UPDATE folders SET status=:status WHERE path=:path")
+        query.bindValue(':path', path)
+        query.bindValue(':status', int(status))
+        if query.exec():
+            query.clear()
+        return True
+
+    def removeFilesBeforeReindex(self, folder_id):
+        """ before reindex a folder, remove old indexed files from that folder
+        to prevent duplication
+        """
+        return GDBModule.deleteIndexed(['files', 'directories'], "folder_id=?", [folder_id], self.con)
+
+    def removeOrphanFiles(self, folder_id):
+        """ after reindex, remove files from directories which are not known anymore
+        (also the files indexed before directories were recorded)
+        """
+        orphans = "folder_id=? AND dir_id NOT IN (SELECT id FROM directories WHERE folder_id=?)"
+        return GDBModule.deleteIndexed(['files'], orphans, [folder_id, folder_id], self.con)
+
+    def getUncategorizedCategoryId(self):
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare("SELECT id FROM categories WHERE category=:category")
+        query.bindValue(':category', 'Uncategorized')
+        if query.exec():
+            while query.first():
+                return query.value(0)
+
+    def addNewExtension(self, ext):
+        # the extension could be added meanwhile by the indexer of another drive
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare("SELECT id FROM extensions WHERE extension=:extension")
+        query.bindValue(':extension', ext)
+        if query.exec() and query.first():
+            return query.value(0)
+
+        category_uncategorized = self.getUncategorizedCategoryId()
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare(
+            "INSERT INTO extensions ('extension', 'category_id', 'selected') VALUES (?, ?, ?)")
+        query.addBindValue(ext)
+        query.addBindValue(category_uncategorized)
+        query.addBindValue(1)
+        if query.exec():
+            return query.lastInsertId()
+        else:
+            GDBModule.printQueryErr(query, 'addFile')
@@ -1,11 +1,16 @@
 import os
+import stat
+import sys
+import threading
+import time
 
 from PyQt5 import QtCore, QtSql
-from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot, QDir
+from PyQt5.QtCore import QObject, QRunnable, pyqtSlot, QThreadPool
 
 from mymodules import GDBModule
 from mymodules.GDBModule import getPreferenceByName
 from mymodules.GlobalFunctions import getForbiddenFolders
+from mymodules.IndexWriterModule import IndexWriter, WriterChannel
 
 
 def percentage(part, whole):
@@ -14,41 +19,207 @@ def percentage(part, whole):
     return int(result)
 
 
+def joinPath(path, name):
+    """ join like QDir.filePath, always with '/' as separator """
+    if path.endswith('/'):
+        return path + name
+    return path + '/' + name
+
+
+def fileSuffix(filename):
+    """ same as QFileInfo.suffix(): the text after the last dot """
+    dot = filename.rfind('.')
+    return filename[dot + 1:] if dot != -1 else ''
+
+
+def isHiddenEntry(entry):
+    """ dot entries are hidden on every system, on Windows also check the hidden attribute """
+    if entry.name.startswith('.'):
+        return True
+    if sys.platform == 'win32':
+        # on Windows the stat of a DirEntry comes for free from the directory listing
+        return bool(entry.stat(follow_symlinks=False).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+    return False
+
+
+def usedInodes(folder):
+    """
+    used inodes of the partition, when folder is the mount point of the partition
+    on filesystems without inodes (or not a mount point) returns 0
+    """
+    if not hasattr(os, 'statvfs') or not os.path.ismount(folder):
+        return 0
+    try:
+        info = os.statvfs(folder)
+    except OSError:
+        return 0
+    return max(0, info.f_files - info.f_ffree)
+
+
+def scanDirectory(path, include_hidden, skip_directory):
+    """
+    list a single directory with os.scandir
+    returns (mtime, files, subdirectories), files being a list of os.DirEntry
+    the mtime (in nanoseconds) is read before listing, so a change made while listing is seen by the next index
+    symlinks are never followed, skip_directory(path, name) decides if a subdirectory is returned
+    raise OSError if the directory can't be read
+    """
+    mtime = os.stat(path).st_mtime_ns
+    files = []
+    subdirectories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_symlink() or (not include_hidden and isHiddenEntry(entry)):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirectory = joinPath(path, entry.name)
+                if not skip_directory(subdirectory, entry.name):
+                    subdirectories.append(subdirectory)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry)
+    return mtime, files, subdirectories
+
+
+def walkDirectories(root, include_hidden, skip_directory):
+    """
+    iterative walker based on os.scandir
+    yields (path, mtime, files, subdirectories) for each visited directory
+    directories are visited depth-first using an explicit stack, so deep trees can't hit the recursion limit
+    """
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime, files, subdirectories = scanDirectory(path, include_hidden, skip_directory)
+        except OSError as e:
+            print(f"Could not read directory {path}: {e.strerror}")
+            continue
+        yield path, mtime, files, subdirectories
+        # reversed, to visit subdirectories in listing order
+        stack.extend(reversed(subdirectories))
+
+
 class WorkerKilledException(Exception):
     pass
 
 
+class FolderUnreachableException(Exception):
+    """ a folder being indexed can't be read anymore, its index is kept as it was """
+
+
+class ProgressEstimator:
+    """
+    Estimates the number of files to check, without walking the folders before indexing
+    starts from what is expected (files of the previous index or used inodes)
+    and is refined with the average of files per directory while the walk proceeds
+    """
+
+    def __init__(self, expected=0, exact=False):
+        self.expected = expected
+        # expected is the real number of files, counted before indexing
+        self.exact = exact
+        self.directories_found = 0
+        self.directories_done = 0
+
+    def rootAdded(self):
+        self.directories_found += 1
+
+    def directoryDone(self, subdirectories):
+        self.directories_done += 1
+        self.directories_found += subdirectories
+
+    def total(self, checked):
+        if self.exact or not self.directories_done:
+            return max(self.expected, checked)
+        pending = self.directories_found - self.directories_done
+        projected = checked + pending * checked / self.directories_done
+        return max(self.expected, projected)
+
+    def percentage(self, checked):
+        total = self.total(checked)
+        if not total:
+            return 0
+        # an estimation never reports 100 before the end
+        return min(100 if self.exact else 99, percentage(checked, total))
+
+
+class ProgressReporter:
+    """
+    Progress of a walker is sent as a snapshot at most every interval seconds,
+    so the GUI is not flooded with a signal for each file and each directory
+    """
+
+    def __init__(self, signal, interval=0.1):
+        self.signal = signal
+        self.interval = interval
+        self.next_report = 0.0
+        self.last_time = time.monotonic()
+        self.last_checked = 0
+        self.files_per_second = 0
+
+    def report(self, checked, found, percentage, path):
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            self.files_per_second = int((checked - self.last_checked) / elapsed)
+        self.last_time = now
+        self.last_checked = checked
+        self.next_report = now + self.interval
+        self.signal.emit({'checked': checked, 'found': found, 'percentage': percentage, 'path': path,
+                          'files_per_second': self.files_per_second})
+
+
 # we need this WorkerSignals, because QRunnable hasn't signals
 # WorkerSignals is derived from Object and have signals
 class WorkerSignals(QObject):
-    progress = pyqtSignal(int)
-    match_found = QtCore.pyqtSignal()
-    directory_changed = QtCore.pyqtSignal(str)
+    progress_snapshot = QtCore.pyqtSignal(object)
     finished = QtCore.pyqtSignal()
     status_folder_changed = QtCore.pyqtSignal()
 
 
 class JobRunner(QRunnable):
-    signals = WorkerSignals()
+    """
+    Walker of the indexing pipeline
+    it reads the folders and sends the changes to an IndexWriter, which saves them
+    without index_writer, the runner starts and stops its own writer
+    """
 
-    def __init__(self):
+    def __init__(self, connection_name='indexer_walker_connection', index_writer=None):
         super().__init__()
         self.is_killed = False
-
-        self.con = GDBModule.connection('indexer_connection')
-        self.con.open()
-        self.extensions = self.getExtensionsList()
-        self.forbidden_folders = getForbiddenFolders()
+        # each runner has its own signals, more runners can work at the same time
+        self.signals = WorkerSignals()
+        self.own_writer = index_writer is None
+        self.index_writer = IndexWriter() if self.own_writer else index_writer
+
+        # connection used only for reading, all changes are saved by the writer
+        # it is opened by run, a connection is used only by the thread which opened it
+        self.connection_name = connection_name
+        self.con = None
+        self.extensions = {}
+        self.extension_ids = {}
+        self.setExtensions(self.getExtensionsList())
+        self.forbidden_folders = set(getForbiddenFolders())
+        self.registered_folders = set()
         self.folders_to_index = []
         self.found_files = 0
         self.total_files = 0
         self.checked_files = 0
         self.percentage = 0
         self.folder_id = 0
+        self.current_path = ''
+        self.resume_append = False
+        self.done = threading.Event()
+        self.thread_finished = False
+        self.reporter = ProgressReporter(self.signals.progress_snapshot)
         self.remove_indexed = True
         self.index_all_types_of_files = False
         self.index_files_without_extension = True
         self.index_hidden_content = int(getPreferenceByName('index_hidden_content'))
+        self.exact_progress_count = int(getPreferenceByName('exact_progress_count'))
+        self.incremental_reindex = int(getPreferenceByName('incremental_reindex'))
+        self.estimator = ProgressEstimator()
+        self.writer = WriterChannel(self.index_writer)
 
     def reInitializeToZero(self):
         self.found_files = 0
@@ -59,21 +230,59 @@ class JobRunner(QRunnable):
     @pyqtSlot()
     def run(self):
         try:
+            # the writer is started first, finishThread always waits for it to end
+            if self.own_writer:
+                QThreadPool.globalInstance().start(self.index_writer)
+            self.con = GDBModule.connection(self.connection_name, 'read-only')
             self.reInitializeToZero()
-            self.total_files = self.countTotalFiles(self.folders_to_index)
+            # registered folders are checked for each subdirectory, they are loaded only once
+            self.registered_folders = self.registeredFolders()
+            if self.exact_progress_count:
+                self.total_files = self.countTotalFiles(self.folders_to_index)
+            else:
+                self.total_files = self.expectedFiles(self.folders_to_index)
+            self.estimator = ProgressEstimator(self.total_files, self.exact_progress_count)
 
             for folder in self.folders_to_index:
                 self.folder_id = self.folderId(folder)
-                if self.remove_indexed:
+                # a stopped index continues from the directories saved before, instead of starting over
+                interrupted = self.isInterrupted(self.folder_id)
+                # incremental reindex saves only the differences from the indexed files
+                incremental = self.remove_indexed and (self.incremental_reindex or interrupted)
+                # when indexing for a new extension, the files saved before stopping are not added again
+                self.resume_append = interrupted and not self.remove_indexed
+                # an unplugged drive or a renamed folder would be seen as empty, and its index removed
+                if not os.path.isdir(folder):
+                    raise FolderUnreachableException(f"{folder} is not found")
+                if self.remove_indexed and not incremental:
                     self.removeFilesBeforeReindex(self.folder_id)
                 self.setStatusFolder(folder, 0)
                 self.signals.status_folder_changed.emit()
-                self._index(folder)
+                self.estimator.rootAdded()
+                if incremental:
+                    self._reindex(folder)
+                else:
+                    self._index(folder)
+                if incremental:
+                    self.removeOrphanFiles(self.folder_id)
                 self.setStatusFolder(folder, 1)
                 self.signals.status_folder_changed.emit()
             self.finishThread()
         except WorkerKilledException:
             pass
+        except FolderUnreachableException as e:
+            # the folder keeps status 0, so it is indexed again when it can be read
+            print(f"Indexing stopped, folder can't be read: {str(e)}")
+            self.finishThread()
+        except Exception as e:
+            # the folder being indexed keeps status 0, so the next index continues it
+            print(f"Indexing stopped by an error: {str(e)}")
+            if not self.thread_finished:
+                self.finishThread()
+        finally:
+            self.con = None
+            GDBModule.removeConnection(self.connection_name)
+            self.done.set()
 
     # check if the thread is killed
     def amIKilled(self):
@@ -81,61 +290,183 @@ class JobRunner(QRunnable):
             self.finishThread()
             raise WorkerKilledException
 
-    def _index(self, path):
+    def _index(self, root):
+        """
+        index all files from root and its subdirectories
+        """
+        for path, mtime, files, subdirectories in walkDirectories(root, self.index_hidden_content, self.skipDirectory):
+            self.amIKilled()
+            self.current_path = path
+            if time.monotonic() >= self.reporter.next_report:
+                self.reportProgress()
+            self.writer.flushIfDue()
+            indexed = self.indexedFiles(path) if self.resume_append else {}
+            # files are saved with the id of their directory
+            self.writer.registerDirectory(self.folder_id, path)
+            for entry in files:
+                if entry.name not in indexed:
+                    self.addFileByExtension(entry, path)
+            # when indexing only for a new extension, the directories are not completely indexed
+            if self.remove_indexed:
+                self.saveDirectory(path, mtime, subdirectories)
+            self.estimator.directoryDone(len(subdirectories))
+
+    def _reindex(self, root):
         """
-        recursive method for indexing files
+        reindex root comparing it with the indexed files
+        a directory having the same mtime as in the last index has the same entries,
+        so it is not listed again and only its known subdirectories are checked
+        files changed in place, without changing their directory, are found only by a full reindex
         """
-        self.amIKilled()
-
-        # switch to new directory (root or recursive)
-        directory = QtCore.QDir(path)
-        directory.setFilter(directory.filter() | QtCore.QDir.NoDotAndDotDot | QtCore.QDir.NoSymLinks)
-        if self.index_hidden_content:
-            directory.setFilter(directory.filter() | QtCore.QDir.Hidden)
-        self.signals.directory_changed.emit(path)
-
-        for entry in directory.entryInfoList():
-            if entry.isDir():
-                dir = QDir(entry.filePath())
-                actual_dir_name = dir.dirName()
-                if self.folderExists(entry.filePath()) or self.folderIsForbidden(actual_dir_name):
+        known = self.knownDirectories(self.folder_id)
+        # files of unchanged directories are not listed, they are counted as checked for the progress
+        file_counts = self.knownFileCounts(self.folder_id)
+        # known subdirectories of each directory, the key of 'C:/' is 'C:'
+        children = {}
+        for path in known:
+            if path != root:
+                children.setdefault(path[:path.rfind('/')], []).append(path)
+
+        visited = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            self.amIKilled()
+            try:
+                status = os.stat(path) if path == root else os.lstat(path)
+            except OSError as e:
+                # not visited, so it is removed with its subdirectories, only when it is surely gone
+                self.confirmRemoved(root, path, e)
+                continue
+            if not stat.S_ISDIR(status.st_mode):
+                continue
+            visited.add(path)
+            self.current_path = path
+            if time.monotonic() >= self.reporter.next_report:
+                self.reportProgress()
+            self.writer.flushIfDue()
+
+            known_subdirectories = [subdirectory for subdirectory in children.get(path.rstrip('/'), [])
+                                    if not self.skipKnownDirectory(subdirectory)]
+            if path in known and known[path] == status.st_mtime_ns:
+                subdirectories = known_subdirectories
+                self.checked_files += file_counts.get(path, 0)
+            else:
+                try:
+                    mtime, files, subdirectories = scanDirectory(path, self.index_hidden_content, self.skipDirectory)
+                except FileNotFoundError as e:
+                    visited.discard(path)
+                    self.confirmRemoved(root, path, e)
                     continue
+                except OSError as e:
+                    # a directory which can't be read keeps what was indexed in it
+                    print(f"Could not read directory {path}: {e.strerror}")
+                    subdirectories = known_subdirectories
+                else:
+                    if path not in known:
+                        self.writer.registerDirectory(self.folder_id, path)
+                    self.compareDirectory(path, files)
+                    self.saveDirectory(path, mtime, subdirectories)
+            self.estimator.directoryDone(len(subdirectories))
+            stack.extend(reversed(subdirectories))
+
+        for path in known:
+            if path not in visited:
+                self.writer.removeDirectory(self.folder_id, path)
+
+    @staticmethod
+    def confirmRemoved(root, path, error):
+        """
+        a directory is removed from the index only if it is not found while its parent is still there,
+        any other error, like an unplugged drive, stops the index before anything is removed
+        """
+        parent = os.path.dirname(path.rstrip('/'))
+        if path != root and isinstance(error, FileNotFoundError) and os.path.isdir(root) and os.path.isdir(parent):
+            return
+        raise FolderUnreachableException(f"{path}: {error.strerror}")
+
+    def compareDirectory(self, path, files):
+        """ save only the differences between the files found in path and the indexed ones """
+        indexed = self.indexedFiles(path)
+        for entry in files:
+            item = self.fileItem(entry, path)
+            if item is None:
+                continue
+            previous = indexed.pop(entry.name, None)
+            if previous is None:
+                self.writer.addFile(item)
+            elif previous[1:] != (item['size'], item['mtime'], item['extension_id']):
+                self.writer.updateFile(previous[0], item)
+        # indexed files which are not found anymore, or are not allowed anymore
+        for previous in indexed.values():
+            self.writer.deleteFile(previous[0])
+
+    def saveDirectory(self, path, mtime, subdirectories):
+        """
+        subdirectories are registered with the directory, so even if the indexer is stopped
+        the next reindex knows they were not indexed yet
+        """
+        for subdirectory in subdirectories:
+            self.writer.registerDirectory(self.folder_id, subdirectory)
+        self.writer.saveDirectory(self.folder_id, path, mtime)
 
-                self._index(entry.filePath())
+    def skipDirectory(self, path, name):
+        """ folders indexed separately and forbidden folders are not walked """
+        return self.folderExists(path) or self.folderIsForbidden(name)
 
-            if entry.isFile():
-                self.addFileByExtension(entry, path)
+    def skipKnownDirectory(self, path):
+        name = path[path.rfind('/') + 1:]
+        return self.skipDirectory(path, name) or (not self.index_hidden_content and name.startswith('.'))
 
     def countTotalFiles(self, roots):
         """ count the files in directories roots is array of folders
+        walks all the folders before indexing, used only when exact progress is wanted
         """
         count = 0
         for root in roots:
-            for root_dir, cur_dir, files in os.walk(root, topdown=True):
-                dir = QDir(root_dir)
-                actual_dir_name = dir.dirName()
-                if actual_dir_name not in self.forbidden_folders:
-                    count += len(files)
+            for path, mtime, files, subdirectories in walkDirectories(root, self.index_hidden_content,
+                                                                      self.skipDirectory):
+                self.amIKilled()
+                count += len(files)
         return count
 
-    def extensionIdForFile(self, entry):
+    def expectedFiles(self, roots):
+        """ files expected in roots, known without walking them
+        files recorded by the previous index of the folder, or the used inodes if the folder is a whole partition
+        """
+        count = 0
+        for root in roots:
+            count += max(self.previousFilesCount(self.folderId(root)), usedInodes(root))
+        return count
+
+    def previousFilesCount(self, folder_id):
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare("SELECT COUNT(*) FROM files WHERE folder_id=:folder_id")
+        query.bindValue(':folder_id', folder_id)
+        if query.exec() and query.first():
+            count = query.value(0)
+            query.clear()
+            return count
+        return 0
+
+    def extensionIdForFile(self, filename):
         # suppose the file has no extension
         extension_id = 'no_extension'
 
         # check if file has any extension
-        ext = entry.suffix() or entry.completeSuffix()
-        file_ext = ext.lower()
+        file_ext = fileSuffix(filename).lower()
         # extension of file is in usual list's of extensions
-        if file_ext in self.extensions.values():
+        if file_ext in self.extension_ids:
             # is a listed extension; assign it id as extension_id to file
-            extension_id = self.extensionId(file_ext)
+            extension_id = self.extension_ids[file_ext]
 
         # file hasn't extension in usual list (previously checked), but must index all types of files
         elif file_ext and self.index_all_types_of_files and extension_id == 'no_extension':
             # save new extension and get its id and assign to file
             extension_id = self.addNewExtension(file_ext)
-            # re-assign usual extensions to indexed to include the newly added extension
-            self.reAssignExtensions()
+            # the newly added extension is known for the next files
+            self.extensions[extension_id] = file_ext
+            self.extension_ids[file_ext] = extension_id
         # file has extension but is not an allowed extension type
         elif file_ext and not self.index_all_types_of_files:
             extension_id = 'not_allowed_extension'
@@ -143,11 +474,19 @@ class JobRunner(QRunnable):
         return extension_id
 
     def addFileByExtension(self, entry, path):
+        item = self.fileItem(entry, path)
+        if item:
+            # buffer file, it will be saved with the next batch
+            self.writer.addFile(item)
+
+    def fileItem(self, entry, path):
+        """ the record of a found file, or None when the file must not be indexed """
         self.checked_files += 1
-        self.percentage = percentage(self.checked_files, self.total_files)
+        if time.monotonic() >= self.reporter.next_report:
+            self.reportProgress()
 
         # here we get extension_id as number or 'no_extension' or 'not_allowed_extension'
-        extension_id = self.extensionIdForFile(entry)
+        extension_id = self.extensionIdForFile(entry.name)
 
         if extension_id != 'not_allowed_extension':
             if extension_id == 'no_extension':
@@ -159,52 +498,55 @@ class JobRunner(QRunnable):
             # here we have numeral, None or no_save
             # we save numeral or None
             if extension_id != 'no_save':
-                item = {'dir': path, 'filename': entry.fileName(), 'size': entry.size(),
+                try:
+                    status = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    # removed since the directory was listed
+                    return None
+                except OSError as e:
+                    print(f"Could not read file {joinPath(path, entry.name)}: {e.strerror}")
+                    return None
+                item = {'dir': path, 'filename': entry.name, 'size': status.st_size, 'mtime': status.st_mtime_ns,
                         'extension_id': extension_id, 'folder_id': self.folder_id}
                 self.found_files += 1
-                self.signals.match_found.emit()
-                # insert file in database
-                self.addFile(item)
-
-    def getUncategorizedCategoryId(self):
-        """Get folder id inside of worker"""
-        query = QtSql.QSqlQuery(self.con)
-        query.prepare("SELECT id FROM categories WHERE category=:category")
-        query.bindValue(':category', 'Uncategorized')
-        if query.exec():
-            while query.first():
-                return query.value(0)
+                return item
+        return None
 
     def addNewExtension(self, ext):
-        category_uncategorized = self.getUncategorizedCategoryId()
+        return self.writer.request('addNewExtension', ext)
 
-        query = QtSql.QSqlQuery(self.con)
-        query.prepare(
-            "INSERT INTO extensions ('extension', 'category_id', 'selected') VALUES (?, ?, ?)")
-        query.addBindValue(ext)
-        query.addBindValue(category_uncategorized)
-        query.addBindValue(1)
-        if query.exec():
-            return query.lastInsertId()
-        else:
-            GDBModule.printQueryErr(query, 'addFile')
+    def reportProgress(self):
+        self.percentage = self.estimator.percentage(self.checked_files)
+        self.reporter.report(self.checked_files, self.found_files, self.percentage, self.current_path)
 
     def finishThread(self):
-        self.con.close()
-        self.signals.finished.emit()
+        # send what was found until now, also when the thread is killed or stopped by an error
+        self.thread_finished = True
+        try:
+            self.writer.flush()
+            if self.own_writer:
+                self.index_writer.finish()
+            if self.con is not None:
+                self.con.close()
+            self.reportProgress()
+        finally:
+            self.signals.finished.emit()
 
     def kill(self):
         self.is_killed = True
 
     def setExtensions(self, extensions):
-        self.extensions = extensions
+        """ extensions is {id: extension}, a reversed dictionary is kept for files lookup """
+        self.extensions = dict(extensions)
+        self.extension_ids = {extension: extension_id for extension_id, extension in self.extensions.items()}
 
     def reAssignExtensions(self):
-        self.extensions = self.getExtensionsList()
+        self.setExtensions(self.getExtensionsList())
 
     def getExtensionsList(self):
         extensions = {}
-        query = QtSql.QSqlQuery(self.con)
+        # before run, the extensions are read by the thread creating the runner
+        query = QtSql.QSqlQuery(self.con or QtSql.QSqlDatabase.database())
         query.prepare("SELECT id, extension from extensions")
         if query.exec():
             while query.next():
@@ -213,41 +555,58 @@ class JobRunner(QRunnable):
         return extensions
 
     def setStatusFolder(self, path, status):
+        """ it waits until the files found before are saved """
+        return self.writer.request('setStatusFolder', path, status)
+
+    def removeFilesBeforeReindex(self, folder_id):
+        self.writer.send('removeFilesBeforeReindex', folder_id)
+
+    def removeOrphanFiles(self, folder_id):
+        self.writer.send('removeOrphanFiles', folder_id)
+
+    def knownDirectories(self, folder_id):
+        """ {path: mtime} of the directories recorded for folder, mtime is None if not indexed yet """
+        directories = {}
         query = QtSql.QSqlQuery(self.con)
-        query.prepare("UPDATE folders SET status=:status WHERE path=:path")
-        query.bindValue(':path', path)
-        query.bindValue(':status', int(status))
+        query.prepare("SELECT path, mtime FROM directories WHERE folder_id=:folder_id")
+        query.bindValue(':folder_id', folder_id)
         if query.exec():
+            while query.next():
+                directories[query.value(0)] = query.value(1)
             query.clear()
-        return True
+        return directories
 
-    def removeFilesBeforeReindex(self, folder_id):
-        """ before reindex a folder, remove old indexed files from that folder
-        to prevent duplication
-        """
+    def knownFileCounts(self, folder_id):
+        """ {path: number of files} of the directories of folder having indexed files """
+        counts = {}
         query = QtSql.QSqlQuery(self.con)
-        query.prepare("""Delete from files where folder_id=:folder_id""")
+        query.prepare("SELECT d.path, COUNT(*) FROM files f JOIN directories d ON d.id = f.dir_id "
+                      "WHERE d.folder_id=:folder_id GROUP BY d.id")
         query.bindValue(':folder_id', folder_id)
-        if not query.exec():
-            GDBModule.printQueryErr(query, 'removeFilesBeforeReindex')
-
-    def extensionId(self, extension):
-        for key, value in self.extensions.items():
-            if extension == value:
-                return key
+        if query.exec():
+            while query.next():
+                counts[query.value(0)] = query.value(1)
+            query.clear()
+        return counts
 
-    def addFile(self, file):
-        """Used by indexer thread with own connection
-        to add new-found file to database"""
+    def indexedFiles(self, path):
+        """ {filename: (id, size, mtime, extension_id)} of the files indexed in directory path """
+        files = {}
         query = QtSql.QSqlQuery(self.con)
-        query.prepare(
-            "INSERT INTO files (%s) VALUES (%s)" % (','.join(file.keys()), ','.join("?" * len(file.values()))))
-        for binder in file.values():
-            query.addBindValue(binder)
+        query.prepare("""SELECT f.id, f.filename, f.size, f.mtime, f.extension_id FROM files f 
+        JOIN directories d ON d.id = f.dir_id 
+        WHERE d.folder_id=:folder_id AND d.path=:dir""")
+        query.bindValue(':folder_id', self.folder_id)
+        query.bindValue(':dir', path)
         if query.exec():
-            return True
-        else:
-            GDBModule.printQueryErr(query, 'addFile')
+            while query.next():
+                filename = query.value(1)
+                if filename in files:
+                    # same file indexed twice, keep only one record
+                    self.writer.deleteFile(files[filename][0])
+                files[filename] = (query.value(0), query.value(2), query.value(3), query.value(4))
+            query.clear()
+        return files
 
     def folderId(self, path):
         """Get folder id inside of worker"""
@@ -262,19 +621,162 @@ class JobRunner(QRunnable):
             while query.first():
                 return query.value(0)
 
+    def isInterrupted(self, folder_id):
+        """ the last index of the folder was stopped before the end, and saved some files or directories """
+        query = QtSql.QSqlQuery(self.con)
+        query.prepare("""SELECT status = 0 
+        AND (EXISTS (SELECT 1 FROM directories WHERE folder_id=:folder_id) 
+        OR EXISTS (SELECT 1 FROM files WHERE folder_id=:folder_id))
+        FROM folders WHERE id=:folder_id""")
+        query.bindValue(':folder_id', folder_id)
+        interrupted = query.exec() and query.first() and bool(query.value(0))
+        query.clear()
+        return interrupted
+
     def folderExists(self, folder: str) -> bool:
         """
         :param folder:
         :return:
-        check if a folder exists
+        check if a folder is registered
         """
+        return folder in self.registered_folders
+
+    def registeredFolders(self):
+        """ paths of all registered folders """
+        folders = set()
         query = QtSql.QSqlQuery(self.con)
-        query.prepare("SELECT path FROM folders where path=:path limit 1")
-        query.bindValue(':path', folder)
-        ret = query.exec() and query.first()
-        query.clear()
-        return ret
+        if query.exec("SELECT path FROM folders"):
+            while query.next():
+                folders.add(query.value(0))
+            query.clear()
+        return folders
 
     def folderIsForbidden(self, folder):
         return folder.lower() in self.forbidden_folders
 
+
+class IndexScheduler(QObject):
+    """
+    Index folders from more drives at the same time
+    one JobRunner is started for each drive, it indexes the folders of its drive one after another,
+    so the heads of a drive never move between two folders
+    all runners send their changes to a single IndexWriter
+    the signals of runners are gathered, progress is the progress of all drives
+    """
+    progress_snapshot = QtCore.pyqtSignal(object)
+    status_folder_changed = QtCore.pyqtSignal()
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.threadpool = QThreadPool()
+        self.index_writer = None
+        self.folders_by_drive = {}
+        self.runners = {}
+        self.finished_drives = set()
+        self.snapshots = {}
+        self.extensions = None
+        self.remove_indexed = True
+        self.index_all_types_of_files = False
+        self.index_files_without_extension = True
+
+    def addFolder(self, folder, serial):
+        self.folders_by_drive.setdefault(serial, []).append(folder)
+
+    def setExtensions(self, extensions):
+        self.extensions = extensions
+
+    @property
+    def folders_to_index(self):
+        return [folder for folders in self.folders_by_drive.values() for folder in folders]
+
+    @property
+    def found_files(self):
+        return sum(runner.found_files for runner in self.runners.values())
+
+    @property
+    def percentage(self):
+        """ progress of all drives, weighted by the files of each drive """
+        if len(self.finished_drives) == len(self.runners):
+            return 100
+        checked = 0
+        total = 0
+        for serial, runner in self.runners.items():
+            checked += runner.checked_files
+            if serial in self.finished_drives:
+                total += runner.checked_files
+            else:
+                total += runner.estimator.total(runner.checked_files)
+        if not total:
+            return 0
+        return min(99, percentage(checked, total))
+
+    def statistics(self):
+        """ counters of the pipeline, to see if walking or writing is the slower part """
+        if self.index_writer is None:
+            return {}
+        return self.index_writer.statistics.asDict()
+
+    def start(self):
+        if not self.folders_by_drive:
+            self.finished.emit()
+            return
+        # a thread for each drive and one for the writer
+        self.threadpool.setMaxThreadCount(len(self.folders_by_drive) + 1)
+        self.index_writer = IndexWriter()
+        self.index_writer.signals.finished.connect(self.finished)
+        self.threadpool.start(self.index_writer)
+        for serial, folders in self.folders_by_drive.items():
+            runner = JobRunner(f'indexer_connection_{serial}', self.index_writer)
+            runner.folders_to_index = folders
+            runner.remove_indexed = self.remove_indexed
+            runner.index_all_types_of_files = self.index_all_types_of_files
+            runner.index_files_without_extension = self.index_files_without_extension
+            if self.extensions is not None:
+                runner.setExtensions(self.extensions)
+            runner.signals.progress_snapshot.connect(
+                lambda snapshot, serial=serial: self.onProgressSnapshot(serial, snapshot))
+            runner.signals.status_folder_changed.connect(self.status_folder_changed)
+            runner.signals.finished.connect(lambda serial=serial: self.onRunnerFinished(serial))
+            self.runners[serial] = runner
+        for runner in self.runners.values():
+            self.threadpool.start(runner)
+
+    def kill(self):
+        for runner in self.runners.values():
+            runner.kill()
+
+    def stopAndWait(self):
+        """ stop indexing and wait until what was found is saved, used when the application is closed """
+        self.kill()
+        for runner in self.runners.values():
+            runner.done.wait()
+        if self.index_writer is not None:
+            self.index_writer.finish()
+
+    def onProgressSnapshot(self, serial, snapshot):
+        """
+        snapshots of all drives are gathered in a single one,
+        with the progress of each drive in snapshot['drives']
+        """
+        self.snapshots[serial] = snapshot
+        drives = {drive: 100 if drive in self.finished_drives else last['percentage']
+                  for drive, last in self.snapshots.items()}
+        self.progress_snapshot.emit({
+            'checked': sum(last['checked'] for last in self.snapshots.values()),
+            'found': sum(last['found'] for last in self.snapshots.values()),
+            'files_per_second': sum(last['files_per_second'] for drive, last in self.snapshots.items()
+                                    if drive not in self.finished_drives),
+            'percentage': self.percentage,
+            'path': snapshot['path'],
+            'drives': drives,
+        })
+
+    def onRunnerFinished(self, serial):
+        self.finished_drives.add(serial)
+        if serial in self.snapshots:
+            # the last snapshot of the drive is sent again, as finished
+            self.onProgressSnapshot(serial, self.snapshots[serial])
+        if len(self.finished_drives) == len(self.runners):
+            # finished is emitted by the writer, after saving all changes
+            self.index_writer.stop()
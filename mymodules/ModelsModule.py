@@ -1,46 +1,301 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+
 import numpy as np
 from PyQt5 import QtCore, QtSql, QtGui
-from PyQt5.QtCore import Qt, QSortFilterProxyModel, QPersistentModelIndex
+from PyQt5.QtCore import Qt, QSortFilterProxyModel, QThreadPool
 from PyQt5.QtGui import QIcon
 from PyQt5.QtSql import QSqlTableModel, QSqlRelation
 from PyQt5.QtWidgets import QStyledItemDelegate, QSpinBox, QLineEdit, QDataWidgetMapper
 
 from mymodules import GDBModule as gdb
+from mymodules.FileResultsModule import FileResults, RowBitmap
 from mymodules.GlobalFunctions import HEADER_SEARCH_RESULTS_TABLE, HEADER_DRIVES_TABLE, HEADER_FOLDERS_TABLE, \
-    randomColor, HEADER_DUPLICATES_TABLE
+    HEADER_DUPLICATES_TABLE
 from mymodules.HumanReadableSize import HumanBytes
+from mymodules.SearchQueryModule import SearchRunner
+
+# sizes formatted for the result tables, most of the painted rows are formatted before
+SIZE_TEXT_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=SIZE_TEXT_CACHE_SIZE)
+def sizeText(size):
+    return HumanBytes.format(size, True)
+
+
+class DrivesStatus(QtCore.QObject):
+    """
+    Labels of the mounted drives, read once for all the cells painted by the result tables
+    refreshed when the drives change, then changed asks the tables to paint the Drive column again
+    """
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.labels = None
+
+    def isActive(self, label):
+        if self.labels is None:
+            self.labels = gdb.activeDriveLabels()
+        return label in self.labels
+
+    @QtCore.pyqtSlot()
+    def refresh(self):
+        self.labels = gdb.activeDriveLabels()
+        self.changed.emit()
+
+
+drives_status = DrivesStatus()
 
 
 class SearchResultsTableModel(QtCore.QAbstractTableModel):
-    def __init__(self, data, parent):
+    """
+    Results of a search, found page by page while the table is scrolled
+    each page is searched by a SearchRunner in background, so the table is used while it is loaded
+    only the pages used last are kept, up to SEARCH_WINDOW_ROWS, a page shown again is searched again
+    from the keyset it was found with, so the memory used doesn't grow with the results
+    sorting searches again, from the first page ordered by the sort column, by SQL as SEARCH_SORT_KEYS,
+    unless all the results are in memory in the order of indexing, then they are sorted by a permutation of rows
+    in the same order, names ignoring case as NOCASE and equal values in the order of indexing
+    when all the results are found in the first page, they are sent by results_complete to be cached
+    """
+    count_found = QtCore.pyqtSignal(int)
+    search_failed = QtCore.pyqtSignal(str)
+    results_complete = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, search_query, parent, results=None):
+        """
+        :param search_query: SearchQuery, None for an empty model
+        :param parent:
+        :param results: all the results of the query, when they are known, so they are not searched
+        """
         super(SearchResultsTableModel, self).__init__(parent)
-        self._data = np.array(data.values)
-        self._cols = data.columns
-        self.r, self.c = np.shape(self._data)
+        self.search_query = search_query
+        self.sort_column = -1
+        self.descending = False
+        self._cols = HEADER_SEARCH_RESULTS_TABLE
+        self.c = len(self._cols)
+        self.size_column = self.colIndexByName('Size')
+        self.drive_column = self.colIndexByName('Drive')
+        drives_status.changed.connect(self.onDrivesChanged)
+        self.page_runner = None
+        self.count_runner = None
+        # pages being searched again, by page number
+        self.loading = {}
+        self.clearPages()
+        # all the results in the order of indexing, read in the order of permutation when sorted in memory
+        self.sorted_data = None
+        self.order = None
+        # an empty model, before the first search
+        self.finished = search_query is None or results is not None
+        if results:
+            self.addPage(results, None)
+        if not self.finished:
+            self.count_runner = self.startRunner(count=True)
+            self.count_runner.signals.count_found.connect(self.onCountFound)
+            self.searchNextPage()
+
+    def clearPages(self):
+        # first row and keyset of each page found, the keyset of the next page, and the rows found
+        self.page_starts = []
+        self.page_keys = []
+        self.after = None
+        self.rows = 0
+        # pages in memory, the last used at the end
+        self.pages = OrderedDict()
+
+    def startRunner(self, count=False, after=None, limit=gdb.SEARCH_PAGE_SIZE):
+        runner = SearchRunner(self.search_query, self.sort_column, self.descending, after, count, limit)
+        runner.signals.failed.connect(self.onSearchFailed)
+        QThreadPool.globalInstance().start(runner)
+        return runner
+
+    @staticmethod
+    def pageLimit(page):
+        return gdb.SEARCH_REFINE_LIMIT if page == 0 else gdb.SEARCH_PAGE_SIZE
+
+    def searchNextPage(self):
+        self.page_runner = self.startRunner(after=self.after, limit=self.pageLimit(len(self.page_starts)))
+        self.page_runner.signals.page_found.connect(self.onPageFound)
+
+    def searchPageAgain(self, page):
+        """ search in background a page removed from memory, it is shown when it is found """
+        if page not in self.loading:
+            self.loading[page] = self.startRunner(after=self.page_keys[page], limit=self.pageLimit(page))
+            self.loading[page].signals.page_found.connect(self.onPageFoundAgain)
+
+    def cancel(self):
+        """ stop the searches in progress, their results are not received anymore """
+        for runner in [self.page_runner, self.count_runner] + list(self.loading.values()):
+            if runner is not None:
+                runner.cancel()
+        self.page_runner = self.count_runner = None
+        self.loading = {}
+
+    def release(self):
+        """ stop the searches and delete the model, after a new one is shown instead of it """
+        self.cancel()
+        drives_status.changed.disconnect(self.onDrivesChanged)
+        self.deleteLater()
+
+    def addPage(self, results, after):
+        """ add the rows of the page found after the last one """
+        page = len(self.page_starts)
+        self.beginInsertRows(QtCore.QModelIndex(), self.rows, self.rows + len(results) - 1)
+        self.page_starts.append(self.rows)
+        self.page_keys.append(self.after)
+        self.after = after
+        self.rows += len(results)
+        self.keepPage(page, FileResults(results))
+        self.endInsertRows()
+
+    def keepPage(self, page, results):
+        self.pages[page] = results
+        self.pages.move_to_end(page)
+        # the pages not used for the longest time are removed, the last one is kept
+        kept = sum(len(results) for results in self.pages.values())
+        while kept > gdb.SEARCH_WINDOW_ROWS and len(self.pages) > 1:
+            kept -= len(self.pages.popitem(last=False)[1])
+
+    @QtCore.pyqtSlot(object, object)
+    def onPageFound(self, results, after):
+        if self.page_runner is None or self.sender() is not self.page_runner.signals:
+            return
+        self.page_runner = None
+        first_page = not self.page_starts
+        self.finished = after is None
+        if results:
+            self.addPage(results, after)
+        else:
+            self.after = after
+        if first_page and self.finished and self.sort_column == -1:
+            self.results_complete.emit(self.search_query, self.pages[0].rows() if self.pages else [])
+
+    @QtCore.pyqtSlot(object, object)
+    def onPageFoundAgain(self, results, after):
+        page = next((page for page, runner in self.loading.items() if runner.signals is self.sender()), None)
+        if page is None:
+            return
+        del self.loading[page]
+        self.keepPage(page, FileResults(results))
+        last_row = self.page_starts[page + 1] - 1 if page + 1 < len(self.page_starts) else self.rows - 1
+        self.dataChanged.emit(self.index(self.page_starts[page], 0), self.index(last_row, self.c - 1))
+
+    @QtCore.pyqtSlot(int)
+    def onCountFound(self, count):
+        if self.count_runner is not None and self.sender() is self.count_runner.signals:
+            self.count_runner = None
+            self.count_found.emit(count)
+
+    @QtCore.pyqtSlot(str)
+    def onSearchFailed(self, message):
+        self.cancel()
+        self.finished = True
+        self.search_failed.emit(message)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        # the next page is searched after the current one is received
+        return not parent.isValid() and not self.finished and self.page_runner is None
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if self.canFetchMore(parent):
+            self.searchNextPage()
+
+    def locate(self, row, wait=False):
+        """
+        :param row: row of table
+        :param wait: search the page of row now, if it is not in memory
+        :return: (FileResults, row in them), None while the page of row is searched in background
+        raise SearchError if the page searched now can't be read
+        """
+        if self.sorted_data is not None:
+            return self.sorted_data, row if self.order is None else self.order[row]
+        page = bisect_right(self.page_starts, row) - 1
+        results = self.pages.get(page)
+        if results is not None:
+            self.pages.move_to_end(page)
+        elif wait:
+            found, _ = gdb.findFilesPage(None, self.search_query, self.sort_column, self.descending,
+                                         self.page_keys[page], self.pageLimit(page))
+            results = FileResults(found)
+            self.keepPage(page, results)
+        else:
+            self.searchPageAgain(page)
+            return None
+        row -= self.page_starts[page]
+        # files removed from database since the page was found first are shown empty
+        return (results, row) if row < len(results) else None
+
+    def rowValues(self, row, wait=False):
+        location = self.locate(row, wait)
+        return location[0].row(location[1]) if location is not None else None
+
+    def displayRow(self, values):
+        """ :return: values of a row as they are shown """
+        values = list(values)
+        values[self.size_column] = sizeText(values[self.size_column])
+        return values
+
+    def displayRows(self):
+        """
+        all the results as they are shown, searched again by a single search when they are not all in memory
+        raise SearchError if the results can't be read
+        """
+        if self.allInMemory():
+            for row in range(self.rows):
+                yield self.displayRow(self.rowValues(row))
+            return
+        results, _ = gdb.findFilesPage(None, self.search_query, self.sort_column, self.descending, limit=-1)
+        for values in results:
+            yield self.displayRow(values)
+
+    def allInMemory(self):
+        return self.finished and len(self.pages) == len(self.page_starts)
+
+    @QtCore.pyqtSlot()
+    def onDrivesChanged(self):
+        if self.rows:
+            self.dataChanged.emit(self.index(0, self.drive_column),
+                                  self.index(self.rows - 1, self.drive_column), [Qt.ForegroundRole])
 
     def sort(self, column, order):
         """Sort table by given column number."""
-        try:
+        descending = order == Qt.DescendingOrder
+        if (column, descending) == (self.sort_column, self.descending) or self.search_query is None:
+            return
+        if self.sorted_data is None and self.sort_column == -1 and self.allInMemory():
+            self.sorted_data = FileResults([values for page in range(len(self.page_starts))
+                                            for values in self.pages[page].rows()], gdb.nocaseKey)
+        if self.sorted_data is not None:
+            # an order used before is not computed again, equal values keep the order of indexing as in SQL
             self.layoutAboutToBeChanged.emit()
-            if order == Qt.DescendingOrder:
-                # sort reverse n
-                self._data = self._data[self._data[:, column].argsort()[::-1]]
+            self.sort_column = column
+            self.descending = descending
+            if column < 0:
+                self.order = np.arange(self.rows - 1, -1, -1) if descending else None
             else:
-                self._data = self._data[self._data[:, column].argsort()]
+                ties = np.arange(0, -self.rows, -1) if descending else np.arange(self.rows)
+                self.order = self.sorted_data.sortPermutation(column, descending, ties)
             self.layoutChanged.emit()
-        except Exception as e:
-            print(e)
+            return
+        self.cancel()
+        self.beginResetModel()
+        self.sort_column = column
+        self.descending = descending
+        self.finished = False
+        self.clearPages()
+        self.endResetModel()
+        self.searchNextPage()
 
     def hasMountedDrive(self, index):
-        index_column = self.colIndexByName('Drive')
-        value = str(self._data[index.row()][index_column])
-        return gdb.isDriveActiveByLabel(value)
+        values = self.rowValues(index.row(), True)
+        return values is not None and drives_status.isActive(values[self.drive_column])
 
     def rowData(self, index):
-        row_data = []
-        for idx in enumerate(HEADER_SEARCH_RESULTS_TABLE):
-            row_data.append(str(self._data[index.row()][idx[0]]))
-        return row_data
+        values = self.rowValues(index.row(), True)
+        return [str(value) for value in values] if values is not None else [''] * self.c
 
     def colIndexByName(self, name):
         return [ix for ix, col in enumerate(HEADER_SEARCH_RESULTS_TABLE) if col == name][0]
@@ -48,25 +303,27 @@ class SearchResultsTableModel(QtCore.QAbstractTableModel):
     def data(self, index, role=Qt.DisplayRole):
         if index.isValid():
             if role == Qt.DisplayRole:
-                value = self._data[index.row(), index.column()]
-                if index.column() == 2:
-                    value = HumanBytes.format(value, True)
-                return str(value)
+                location = self.locate(index.row())
+                if location is None:
+                    return ''
+                value = location[0].value(location[1], index.column())
+                if index.column() == self.size_column:
+                    return sizeText(value)
+                return value
             if role == Qt.TextAlignmentRole:
                 if index.column() == 2 or index.column() == 3:
                     return Qt.AlignRight
 
             if role == Qt.ForegroundRole:
-                if index.column() == self.colIndexByName('Drive'):
-                    value = str(self._data[index.row(), index.column()])
-                    # value = str(self._data.iloc[index.row()][index.column()])
-                    is_active = gdb.isDriveActiveByLabel(value)
-                    if not is_active:
+                if index.column() == self.drive_column:
+                    location = self.locate(index.row())
+                    if location is not None and not drives_status.isActive(location[0].value(location[1],
+                                                                                             index.column())):
                         return QtGui.QColor('red')
         return None
 
     def rowCount(self, parent=None):
-        return self.r
+        return self.rows
 
     def columnCount(self, parent=None):
         return self.c
@@ -91,76 +348,87 @@ class SearchResultsTableModel(QtCore.QAbstractTableModel):
 
 
 class DuplicateResultsTableModel(QtCore.QAbstractTableModel):
-    def __init__(self, data, parent):
+    """
+    Files having the same content, in groups
+    the group of each file, the reference file of each group and the color of each group are found once,
+    so painting and sorting don't compare the rows
+    the reference file of a group, the first one found, is kept, the others are checked to be removed
+    """
+
+    def __init__(self, data, parent, groups=None):
+        """
+        :param data: rows with HEADER_DUPLICATES_TABLE columns
+        :param parent:
+        :param groups: group of files with the same content, for each row, each row is a group if None
+        """
         super(DuplicateResultsTableModel, self).__init__(parent)
 
-        self._data = np.array(data.values)
-        self._cols = data.columns
-        self.r, self.c = np.shape(self._data)
-        self.last_color = None
-        self.checks = {}
+        # Remove column is not kept, it is shown by the check state of rows
+        self._data = FileResults(data)
+        self._cols = HEADER_DUPLICATES_TABLE
+        self.r, self.c = len(self._data), len(self._cols)
+        groups = np.arange(self.r) if groups is None else np.asarray(groups, dtype=np.int64)
+        # groups numbered from 0, and the first row of each group
+        self.references, self.groups = np.unique(groups, return_index=True, return_inverse=True)[1:]
+        self.group_colors = [tuple(color) for color in
+                             np.random.default_rng().integers(0, 256, (len(self.references), 3)).tolist()]
+        # rows of _data in the order they are shown
+        self.order = np.arange(self.r)
+        # rows of _data checked to be removed, so they keep it when sorted, a bit for each row
+        checks = np.ones(self.r, dtype=bool)
+        checks[self.references] = False
+        self.checks = RowBitmap(checks)
+        self.size_column = self.colIndexByName('Size')
+        self.drive_column = self.colIndexByName('Drive')
+        self.filename_column = self.colIndexByName('Filename')
+        self.remove_column = self.colIndexByName('Remove')
+        drives_status.changed.connect(self.onDrivesChanged)
 
     def sort(self, column, order):
         """Sort table by given column number."""
-        try:
-            self.layoutAboutToBeChanged.emit()
-            if order == Qt.DescendingOrder:
-                # sort reverse n
-                self._data = self._data[self._data[:, column].argsort()[::-1]]
-            else:
-                self._data = self._data[self._data[:, column].argsort()]
-            self.layoutChanged.emit()
-        except Exception as e:
-            print(e)
+        if column >= len(self._data.columns):
+            return
+        self.layoutAboutToBeChanged.emit()
+        # the files of a group having the same value are kept together
+        self.order = self._data.sortPermutation(column, order == Qt.DescendingOrder, self.groups)
+        self.layoutChanged.emit()
+
+    def release(self):
+        """ delete the model, after a new one is shown instead of it """
+        drives_status.changed.disconnect(self.onDrivesChanged)
+        self.deleteLater()
+
+    @QtCore.pyqtSlot()
+    def onDrivesChanged(self):
+        if self.r:
+            self.dataChanged.emit(self.index(0, self.drive_column), self.index(self.r - 1, self.drive_column),
+                                  [Qt.ForegroundRole])
 
     def hasMountedDrive(self, index):
-        index_column = self.colIndexByName('Drive')
-        value = str(self._data[index.row()][index_column])
-        return gdb.isDriveActiveByLabel(value)
+        return drives_status.isActive(self._data.value(self.order[index.row()], self.drive_column))
 
     def rowData(self, index):
-        row_data = []
-        for idx in enumerate(HEADER_DUPLICATES_TABLE):
-            row_data.append(str(self._data[index.row()][idx[0]]))
-        return row_data
+        return [str(value) for value in self._data.row(self.order[index.row()])]
 
     def colIndexByName(self, name):
         return [ix for ix, col in enumerate(HEADER_DUPLICATES_TABLE) if col == name][0]
 
     def checkState(self, index):
-        if index in self.checks.keys():
-            return self.checks[index]
-        else:
-            row = index.row()
-            next_row = row + 1
-            if next_row < self.rowCount():
-                actual_filename = self._data[row, 1]
-                next_filename = self._data[next_row, 1]
-                actual_size = self._data[row, 2]
-                next_size = self._data[next_row, 2]
-                if actual_size == next_size and actual_filename == next_filename:
-                    return Qt.Unchecked
-                else:
-                    return Qt.Checked
-            return Qt.Unchecked
-
-            # if self._data[index.row(), index.column()] == 0:
-            #     return Qt.Checked
-            # return Qt.Unchecked
+        return Qt.Checked if self.checks[int(self.order[index.row()])] else Qt.Unchecked
 
     def data(self, index, role=Qt.DisplayRole):
         if index.isValid():
             if role == Qt.CheckStateRole:
-                if index.column() == self.colIndexByName('Remove'):
-                    return self.checkState(QPersistentModelIndex(index))
+                if index.column() == self.remove_column:
+                    return self.checkState(index)
 
             if role == Qt.DisplayRole:
-                value = self._data[index.row(), index.column()]
-                if index.column() == 2:
-                    value = HumanBytes.format(value, True)
-                if index.column() == 5:
+                if index.column() == self.remove_column:
                     return ""
-                return str(value)
+                value = self._data.value(self.order[index.row()], index.column())
+                if index.column() == self.size_column:
+                    return sizeText(value)
+                return value
 
             if role == Qt.TextAlignmentRole:
                 if index.column() == 2 or index.column() == 3:
@@ -169,17 +437,11 @@ class DuplicateResultsTableModel(QtCore.QAbstractTableModel):
                     return Qt.AlignCenter
 
             if role == Qt.ForegroundRole:
-                if index.column() == self.colIndexByName('Drive'):
-                    value = str(self._data[index.row(), index.column()])
-                    is_active = gdb.isDriveActiveByLabel(value)
-                    if not is_active:
+                if index.column() == self.drive_column:
+                    if not drives_status.isActive(self._data.value(self.order[index.row()], index.column())):
                         return QtGui.QColor('red')
-                if index.column() == self.colIndexByName('Filename'):
-                    value = str(self._data[index.row(), index.column()])
-                    previous_value = str(self._data[index.row() - 1, index.column()])
-                    if previous_value != value:
-                        self.last_color = randomColor()
-                    return QtGui.QColor(*self.last_color)
+                if index.column() == self.filename_column:
+                    return QtGui.QColor(*self.group_colors[self.groups[self.order[index.row()]]])
 
         return None
 
@@ -187,7 +449,8 @@ class DuplicateResultsTableModel(QtCore.QAbstractTableModel):
         if not index.isValid():
             return False
         if role == Qt.CheckStateRole:
-            self.checks[QPersistentModelIndex(index)] = value
+            self.checks[int(self.order[index.row()])] = value == Qt.Checked
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
             return True
         return False
 
@@ -8,6 +8,8 @@ from mymodules.GlobalFunctions import setPreferenceById, getForbiddenFolders, se
 
 class Preferences(QtWidgets.QWidget):
     change_settings_tab_position = QtCore.pyqtSignal()
+    # a preference is saved, widgets keeping its value read it again
+    preferences_changed = QtCore.pyqtSignal()
 
     def __init__(self, parent=None):
         super(Preferences, self).__init__(parent)
@@ -114,6 +116,7 @@ class Preferences(QtWidgets.QWidget):
         name = gdb.getPreferenceNameById(id)
         if name == 'settings_tab_on_top':
             self.change_settings_tab_position.emit()
+        self.preferences_changed.emit()
 
     def activeButtonsForbiddenFolders(self):
         btn_remove_enabled = len(self.forbidden_folders) and self.forbidden_folders_list.currentItem() \
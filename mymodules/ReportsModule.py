@@ -1,5 +1,5 @@
 from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtCore import QFile
+from PyQt5.QtCore import QFile, Qt
 
 from mymodules import GDBModule as gdb
 from mymodules.ComponentsModule import TableReports
@@ -43,11 +43,36 @@ class Reports(QtWidgets.QWidget):
         self.fillReports()
 
     def fillReports(self):
+        # reports are read from the statistics kept while indexing, not counted from files
         self.reportCategories()
         self.reportDrives()
         self.reportExtensions()
         self.reportDatabase()
 
+    @staticmethod
+    def setGroupLayout(group, layout):
+        # the old layout is moved to a temporary widget, deleted with its widgets
+        if group.layout() is not None:
+            QtWidgets.QWidget().setLayout(group.layout())
+        group.setLayout(layout)
+
+    @QtCore.pyqtSlot()
+    def recomputeStatistics(self):
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        recomputed = gdb.recomputeStatistics()
+        QtWidgets.QApplication.restoreOverrideCursor()
+        if not recomputed:
+            QtWidgets.QMessageBox.warning(None, 'Statistics', 'Could not recompute the statistics!')
+        self.fillReports()
+
+    @QtCore.pyqtSlot()
+    def rebuildSearchIndex(self):
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        rebuilt = gdb.rebuildSearchIndex()
+        QtWidgets.QApplication.restoreOverrideCursor()
+        if not rebuilt:
+            QtWidgets.QMessageBox.warning(None, 'Search index', 'Could not rebuild the search index!')
+
     def reportDatabase(self):
         location = getDatabaseLocation()
         dbFile = QFile(location)
@@ -71,36 +96,54 @@ class Reports(QtWidgets.QWidget):
         layh.addWidget(QtWidgets.QLabel(records))
         lay_v.addLayout(layh)
 
+        # counts all the files again, to check the statistics
+        recompute_button = QtWidgets.QPushButton('Recompute statistics')
+        recompute_button.clicked.connect(self.recomputeStatistics)
+        lay_v.addWidget(recompute_button)
+
+        # fills the search index again from the indexed files, it needs SQLite with the trigram tokenizer
+        rebuild_button = QtWidgets.QPushButton('Rebuild search index')
+        rebuild_button.clicked.connect(self.rebuildSearchIndex)
+        rebuild_button.setEnabled(gdb.searchIndexSupported())
+        lay_v.addWidget(rebuild_button)
+
         lay_v.addStretch()
-        self.group_database.setLayout(lay_v)
+        self.setGroupLayout(self.group_database, lay_v)
 
     def reportDrives(self):
         drives = gdb.filesOnDrive()
         if drives:
-            table = TableReports(drives, ["Drive", "Indexed Files", "Active", "Size (Gb)"], [0.4, 0.2, 0.1, 0.3])
+            for drive in drives:
+                drive[2] = HumanBytes.format(drive[2], True)
+            table = TableReports(drives, ["Drive", "Indexed Files", "Indexed Size", "Active", "Size (Gb)"],
+                                 [0.3, 0.2, 0.2, 0.1, 0.2])
             lay_v = QtWidgets.QVBoxLayout()
             layh = QtWidgets.QHBoxLayout()
             layh.addWidget(table)
             lay_v.addLayout(layh)
-            self.group_drives.setLayout(lay_v)
+            self.setGroupLayout(self.group_drives, lay_v)
 
     def reportCategories(self):
         categories = gdb.categoryAndFiles()
         if categories:
-            table = TableReports(categories, ["Category", "Files"], [0.7, 0.3])
+            for category in categories:
+                category[2] = HumanBytes.format(category[2], True)
+            table = TableReports(categories, ["Category", "Files", "Size"], [0.5, 0.25, 0.25])
             lay_v = QtWidgets.QVBoxLayout()
             layh = QtWidgets.QHBoxLayout()
             layh.addWidget(table)
             lay_v.addLayout(layh)
-            self.group_categories.setLayout(lay_v)
+            self.setGroupLayout(self.group_categories, lay_v)
 
     def reportExtensions(self):
         extensions = gdb.getUsedExtensions()
         if extensions:
-            table = TableReports(extensions, ["Category", "Extension", "Files"], [0.4, 0.3, 0.3])
+            for extension in extensions:
+                extension[3] = HumanBytes.format(extension[3], True)
+            table = TableReports(extensions, ["Category", "Extension", "Files", "Size"], [0.3, 0.25, 0.2, 0.25])
             lay_v = QtWidgets.QVBoxLayout()
             layh = QtWidgets.QHBoxLayout()
             layh.addWidget(table)
             lay_v.addLayout(layh)
-            self.group_extensions.setLayout(lay_v)
+            self.setGroupLayout(self.group_extensions, lay_v)
 
@@ -1,4 +1,3 @@
-import pandas as pd
 from PyQt5 import QtCore
 from PyQt5.QtCore import Qt, QFileInfo
 from PyQt5.QtWidgets import QAbstractItemView
@@ -9,6 +8,7 @@ from mymodules.ComponentsModule import PushButton
 from mymodules.GlobalFunctions import *
 from mymodules.ModelsModule import SearchResultsTableItemsDelegate
 from mymodules.PreviewFileModule import FileDetailDialog
+from mymodules.SearchQueryModule import SearchQuery, SearchQueryError, SearchResultsCache
 
 
 class Search(QtWidgets.QWidget):
@@ -24,7 +24,7 @@ class Search(QtWidgets.QWidget):
 
         self.search_input_label = QtWidgets.QLabel('Search for:')
         self.search_term_input = QtWidgets.QLineEdit()
-        self.search_term_input.setPlaceholderText('Insert term to search')
+        self.search_term_input.setPlaceholderText('Insert term to search, like: holiday ext:jpg size:>2MB')
         self.search_term_input.setFocus(Qt.OtherFocusReason)
 
         self.search_button = PushButton('Search')
@@ -36,6 +36,15 @@ class Search(QtWidgets.QWidget):
         self.search_term_input.returnPressed.connect(self.onSubmitted)
         self.search_button.clicked.connect(self.onSubmitted)
 
+        # search as you type, when typing pauses
+        self.readPreferences()
+        self.typing_timer = QtCore.QTimer(self)
+        self.typing_timer.setSingleShot(True)
+        self.typing_timer.setInterval(SEARCH_TYPING_DELAY)
+        self.typing_timer.timeout.connect(self.onTyped)
+        self.search_term_input.textChanged.connect(self.onTextChanged)
+        self.results_cache = SearchResultsCache()
+
         self.found_search_label = QtWidgets.QLabel('Found')
         self.found_search_label.hide()
 
@@ -45,8 +54,7 @@ class Search(QtWidgets.QWidget):
         self.found_results_table.doubleClicked.connect(self.double_clicked_result_row)
         self.found_results_table.setItemDelegate(SearchResultsTableItemsDelegate(self))
 
-        self.found_results_table_model = ModelsModule.SearchResultsTableModel(
-            pd.DataFrame([], columns=HEADER_SEARCH_RESULTS_TABLE), self.found_results_table)
+        self.found_results_table_model = ModelsModule.SearchResultsTableModel(None, self.found_results_table)
 
         # categories box
         self.categories_selector_search = CategoriesSelector(parent=self)
@@ -91,9 +99,6 @@ class Search(QtWidgets.QWidget):
         self.search_tab_layout = QtWidgets.QVBoxLayout()
         self.search_tab_layout.addLayout(h_main)
 
-        # prepare extensions for search
-        self.extensions_for_search = []
-        self.getExtensionsForSearch()
         self.double_clicked_result_row.connect(self.doubleClickedResultRow)
 
     @QtCore.pyqtSlot()
@@ -107,47 +112,106 @@ class Search(QtWidgets.QWidget):
 
     @QtCore.pyqtSlot()
     def onSubmitted(self):
+        self.typing_timer.stop()
         search_term = self.search_term_input.text()
         if not search_term:
             QtWidgets.QMessageBox.information(None, 'No term to search', 'Please write a term for search')
             return
+        try:
+            search_query = SearchQuery(search_term, self.getCategoriesForSearch())
+        except SearchQueryError as e:
+            QtWidgets.QMessageBox.information(None, 'Invalid search', str(e))
+            return
+        # a submitted search is searched in database, also for the files indexed after the cached searches
+        self.results_cache.clear()
+        self.search(search_query)
+
+    @QtCore.pyqtSlot(str)
+    def onTextChanged(self, text):
+        # each key pressed postpones the search, until typing pauses
+        if self.search_as_you_type:
+            self.typing_timer.start()
+
+    @QtCore.pyqtSlot()
+    def readPreferences(self):
+        """ preferences used for each key pressed are read once, and again when they are saved """
+        self.search_as_you_type = bool(int(getPreference('search_as_you_type')))
+
+    @QtCore.pyqtSlot()
+    def onTyped(self):
+        """ search while typing, the text not finished yet or with only short terms is not searched """
+        try:
+            search_query = SearchQuery(self.search_term_input.text(), self.getCategoriesForSearch())
+        except SearchQueryError:
+            return
+        if not search_query.filters and max(map(len, search_query.terms)) < SEARCH_TYPING_MIN_LENGTH:
+            return
+        current_query = self.found_results_table_model.search_query
+        if current_query is not None and current_query.key() == search_query.key():
+            return
+        self.search(search_query)
+
+    def search(self, search_query):
+        # a new search cancels the previous one
+        self.found_results_table_model.cancel()
+        # results of a previous search, or found by refining them, are shown at once
+        results = self.results_cache.find(search_query)
+        if results is not None:
+            self.updateResults(search_query, results)
+            self.spinner.hide()
+            self.found_search_label.setText(f'Found: {len(results)} results')
+            self.found_search_label.show()
+            return
         self.spinner.show()
         self.found_search_label.setText(f'Please wait! Searching ...')
         self.found_search_label.show()
-        QtTest.QTest.qWait(1000)
 
-        self.getExtensionsForSearch()
-        extensions = self.extensions_for_search
-        # searching
-        results = gdb.findFiles(search_term, extensions)
-        count_results = len(results) if results else 0
+        # searching in background
+        # the first page of results is shown when it is found, the next ones are searched while scrolling
+        self.updateResults(search_query)
 
+    @QtCore.pyqtSlot(int)
+    def onCountFound(self, count_results):
         self.spinner.hide()
-        self.found_search_label.setText(f'Found: {count_results} results')
-        self.updateResults(results)
+        if count_results >= gdb.SEARCH_COUNT_LIMIT:
+            self.found_search_label.setText(f'Found: more than {gdb.SEARCH_COUNT_LIMIT} results')
+        else:
+            self.found_search_label.setText(f'Found: {count_results} results')
 
-    def updateResults(self, results):
-        self.found_results_table_model = ModelsModule.SearchResultsTableModel(
-            pd.DataFrame(results, columns=HEADER_SEARCH_RESULTS_TABLE), self.found_results_table)
+    @QtCore.pyqtSlot(str)
+    def onSearchFailed(self, message):
+        self.spinner.hide()
+        self.found_search_label.setText('Search failed')
+        QtWidgets.QMessageBox.warning(None, 'Search failed', message)
+
+    def updateResults(self, search_query, results=None):
+        old_model = self.found_results_table_model
+        old_selection = self.found_results_table.selectionModel()
+        self.found_results_table_model = ModelsModule.SearchResultsTableModel(search_query, self.found_results_table,
+                                                                              results)
+        self.found_results_table_model.count_found.connect(self.onCountFound)
+        self.found_results_table_model.search_failed.connect(self.onSearchFailed)
+        self.found_results_table_model.results_complete.connect(self.results_cache.add)
 
         self.found_results_table.setModel(self.found_results_table_model)
         self.found_results_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # the view doesn't delete the model and the selection it replaces
+        old_model.release()
+        if old_selection is not None:
+            old_selection.deleteLater()
 
+        # results are in the order of indexing until a column is clicked
+        self.found_results_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
         self.found_results_table.setSortingEnabled(True)
-        # self.found_results_table.sortByColumn(2, Qt.DescendingOrder)
 
-    # load extensions when the search is started
-    # based on checked categories from search form
-    def getExtensionsForSearch(self):
+    # checked categories from search form, the search is limited to their extensions
+    def getCategoriesForSearch(self):
         selected_categories = []
         checkboxes = self.checkboxes_group.findChildren(QtWidgets.QCheckBox)
         for checkbox in checkboxes:
             if checkbox.isChecked():
                 selected_categories.append(checkbox.text())
-        # with selected categories from search form
-        # take the list of extensions for selected categories
-        # and set them for searching
-        self.extensions_for_search = gdb.getExtensionsForCategories(selected_categories)
+        return selected_categories
 
     # synchronize search form categories with defaults
     @QtCore.pyqtSlot()
@@ -166,39 +230,34 @@ class Search(QtWidgets.QWidget):
     @QtCore.pyqtSlot()
     def exportSelectedResultsToCSV(self):
         model = self.found_results_table.model()
-        columns = model.columnCount()
         indexes = self.found_results_table.selectionModel().selectedRows()
         results = []
-        for index in indexes:
-            one_line = []
-            for col in range(0, columns):
-                val = model.data(model.index(index.row(), col), Qt.DisplayRole)
-                # we have to convert values to string if we wish to concatenate them
-                if not isinstance(val, str):
-                    val = '%s' % val
-                one_line.append(val)
-            line = CSV_COLUMN_SEPARATOR.join(one_line)
-            results.append(line)
+        try:
+            for index in indexes:
+                # a selected row may be out of the rows kept in memory, it is searched again
+                values = model.rowValues(index.row(), True)
+                if values is not None:
+                    results.append(self.csvLine(model.displayRow(values)))
+        except gdb.SearchError as e:
+            QtWidgets.QMessageBox.warning(self, 'Export failed', str(e))
+            return False
         return self.putInFile(results)
 
     @QtCore.pyqtSlot()
     def exportAllResultsToCSV(self):
         model = self.found_results_table.model()
-        columns = model.columnCount()
-        rows = model.rowCount()
-        results = []
-        for row in range(0, rows):
-            one_line = []
-            for col in range(0, columns):
-                val = model.data(model.index(row, col), Qt.DisplayRole)
-                # we have to convert values to string if we wish to concatenate them
-                if not isinstance(val, str):
-                    val = '%s' % val
-                one_line.append(val)
-            line = CSV_COLUMN_SEPARATOR.join(one_line)
-            results.append(line)
+        try:
+            results = [self.csvLine(values) for values in model.displayRows()]
+        except gdb.SearchError as e:
+            QtWidgets.QMessageBox.warning(self, 'Export failed', str(e))
+            return False
         return self.putInFile(results)
 
+    @staticmethod
+    def csvLine(values):
+        # we have to convert values to string if we wish to concatenate them
+        return CSV_COLUMN_SEPARATOR.join('%s' % value for value in values)
+
     # we have to pass data as list
     def putInFile(self, data):
         if not data:
@@ -0,0 +1,317 @@
+import itertools
+import re
+import time
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, QRunnable, pyqtSlot
+
+from mymodules import GDBModule
+
+# multipliers of size units, metric as the sizes shown in results
+SIZE_UNITS = {
+    '': 1, 'b': 1,
+    'k': 1000, 'kb': 1000, 'm': 1000 ** 2, 'mb': 1000 ** 2, 'g': 1000 ** 3, 'gb': 1000 ** 3, 't': 1000 ** 4,
+    'tb': 1000 ** 4,
+    'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4,
+}
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*$')
+SIZE_OPERATORS = ['>=', '<=', '>', '<', '=']
+# words separated by spaces, the text between double quotes is a single word
+TOKEN_PATTERN = re.compile(r'(?:[^\s"]+|"[^"]*")+')
+# searches kept by SearchResultsCache, and for how many seconds their results are used
+SEARCH_CACHE_SIZE = 20
+SEARCH_CACHE_SECONDS = 60
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+def parseSize(text):
+    """
+    :param text: number with an optional unit, like 2GB, 700mb or 1.5GiB
+    :return: size in bytes
+    """
+    match = SIZE_PATTERN.match(text.lower())
+    if not match or match.group(2) not in SIZE_UNITS:
+        raise SearchQueryError(f"'{text}' is not a size, write it like 700MB or 2GB")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+class SearchQuery:
+    """
+    Search text parsed in terms and filters, compiled in parameterized SQL
+        holiday 2014           files having both terms in filename or directory
+        "summer holiday"       a term containing spaces
+        ext:mkv,avi            extension
+        size:>2GB              size, also >=, <, <=, = and ranges as size:1GB..2GB
+        drive:Archive03        label of drive
+        path:/photos/2014      text in directory
+        category:Videos        category of extension
+    each filter is a condition using an index: size by idx_files_size_filename_folder,
+    extensions by idx_files_extension, drives by idx_files_folder and directories by the search index of directories
+    a name which is not a filter, like 'C:' in C:/photos, is searched as a term
+    """
+    FILTERS = ['ext', 'size', 'drive', 'path', 'category']
+
+    def __init__(self, text, categories=None):
+        """
+        :param text: search text
+        :param categories: selected categories, None for all of them
+        """
+        self.text = text
+        self.categories = categories
+        self.terms = []
+        self.filters = []
+        self.parse()
+
+    def parse(self):
+        if self.text.count('"') % 2:
+            raise SearchQueryError('A quote is not closed')
+        for token in TOKEN_PATTERN.findall(self.text):
+            token = token.replace('"', '')
+            if not token:
+                continue
+            name, separator, value = token.partition(':')
+            name = name.lower()
+            if separator and name in self.FILTERS:
+                if not value:
+                    raise SearchQueryError(f"Write a value after '{name}:'")
+                self.filters.append((name, value))
+            else:
+                self.terms.append(token)
+        if not self.terms and not self.filters:
+            raise SearchQueryError('Please write a term for search')
+        # an invalid filter is found at once, not when the query runs
+        self.compile(False)
+
+    def compile(self, search_index, step=None):
+        """
+        :param search_index: the connection running the query has the search index
+        :param step: (low, high) ids of the files searched, None for all files
+        :return: from and where clauses of the search, with the values to bind
+        """
+        conditions = []
+        if step is not None:
+            conditions.append(("f.id between ? and ?", list(step)))
+        if self.categories is not None:
+            # files without extension are found in any category
+            placeholder = ','.join("?" * len(self.categories))
+            conditions.append(("(f.extension_id IS NULL OR f.extension_id IN ("
+                               "SELECT e.id FROM extensions e JOIN categories c ON c.id=e.category_id "
+                               "WHERE c.category IN (%s)))" % placeholder, list(self.categories)))
+        for term in self.terms:
+            conditions.append(self.termCondition(term, search_index, step))
+        for name, value in self.filters:
+            conditions.append(getattr(self, name + 'Filter')(value, search_index))
+
+        values = [value for _, condition_values in conditions for value in condition_values]
+        sql = "from files f " \
+              "join directories di on di.id=f.dir_id " \
+              "left join extensions e on e.id=f.extension_id " \
+              "left join folders fo on fo.id=f.folder_id " \
+              "left join drives d on d.serial=fo.drive_id " \
+              "where %s " % (" and ".join(condition for condition, _ in conditions) or "1")
+        return sql, values
+
+    def key(self):
+        """
+        :return: same key for the queries finding the same files, terms and filters don't depend on case
+        """
+        categories = None if self.categories is None else frozenset(self.categories)
+        return (tuple(term.lower() for term in self.terms),
+                tuple((name, value.lower()) for name, value in self.filters), categories)
+
+    def refines(self, other):
+        """
+        :param other: SearchQuery of a previous search
+        :return: the results of this query are a part of the results of the other one
+        it has the same filters and categories, each term of the other one is in a term of this one,
+        like 'holiday' refined by 'holidays 2014'
+        """
+        terms, filters, categories = self.key()
+        other_terms, other_filters, other_categories = other.key()
+        return (filters, categories) == (other_filters, other_categories) and \
+            all(any(other_term in term for term in terms) for other_term in other_terms)
+
+    def matches(self, row):
+        """ a result of a refined query, [dir, filename, ...], has all the terms in directory or filename """
+        directory, filename = row[0].lower(), row[1].lower()
+        return all(term in directory or term in filename for term in self.key()[0])
+
+    @staticmethod
+    def useSearchIndex(term, search_index):
+        return search_index and len(term) >= GDBModule.SEARCH_INDEX_MIN_LENGTH
+
+    @staticmethod
+    def phrase(term):
+        # the term is searched as a phrase, so any character is allowed
+        return '"%s"' % term.replace('"', '""')
+
+    def termCondition(self, term, search_index, step=None):
+        """
+        files having the term in filename, then all files of the directories having it in path
+        the set of their ids is built by each query, it is limited to the ids of the step
+        """
+        if self.useSearchIndex(term, search_index):
+            if step is None:
+                return "f.id in (" \
+                       "   select rowid from files_fts where files_fts match ? " \
+                       "   union " \
+                       "   select id from files " \
+                       "   where dir_id in (select rowid from directories_fts where directories_fts match ?))", \
+                       [self.phrase(term), self.phrase(term)]
+            return "f.id in (" \
+                   "   select rowid from files_fts where files_fts match ? and rowid between ? and ? " \
+                   "   union " \
+                   "   select id from files where id between ? and ? " \
+                   "   and dir_id in (select rowid from directories_fts where directories_fts match ?))", \
+                   [self.phrase(term), *step, *step, self.phrase(term)]
+        return "(di.path like ? or f.filename like ?)", ["%" + term + "%", "%" + term + "%"]
+
+    @staticmethod
+    def extFilter(value, search_index):
+        extensions = [extension.lstrip('.') for extension in value.split(',') if extension.strip('.')]
+        if not extensions:
+            raise SearchQueryError(f"'{value}' is not an extension")
+        placeholder = ','.join("?" * len(extensions))
+        return "f.extension_id IN (SELECT id FROM extensions WHERE extension COLLATE NOCASE IN (%s))" \
+               % placeholder, extensions
+
+    @staticmethod
+    def sizeFilter(value, search_index):
+        if '..' in value:
+            low, high = value.split('..', 1)
+            return "f.size BETWEEN ? AND ?", [parseSize(low), parseSize(high)]
+        for operator in SIZE_OPERATORS:
+            if value.startswith(operator):
+                return f"f.size {operator} ?", [parseSize(value[len(operator):])]
+        return "f.size = ?", [parseSize(value)]
+
+    @staticmethod
+    def driveFilter(value, search_index):
+        return "f.folder_id IN (SELECT fo.id FROM folders fo JOIN drives d ON d.serial=fo.drive_id " \
+               "WHERE d.label = ? COLLATE NOCASE)", [value]
+
+    def pathFilter(self, value, search_index):
+        if self.useSearchIndex(value, search_index):
+            return "f.dir_id IN (SELECT rowid FROM directories_fts WHERE directories_fts MATCH ?)", \
+                   [self.phrase(value)]
+        return "di.path LIKE ?", ["%" + value + "%"]
+
+    @staticmethod
+    def categoryFilter(value, search_index):
+        return "f.extension_id IN (SELECT e.id FROM extensions e JOIN categories c ON c.id=e.category_id " \
+               "WHERE c.category = ? COLLATE NOCASE)", [value]
+
+
+class SearchResultsCache:
+    """
+    Complete results of the last searches, in the order of indexing
+    a search found before is answered from memory, and so is a search refining one of them,
+    by filtering its results instead of searching the database again
+    results older than SEARCH_CACHE_SECONDS are searched again, the files may have been reindexed meanwhile
+    """
+
+    def __init__(self, size=SEARCH_CACHE_SIZE, seconds=SEARCH_CACHE_SECONDS):
+        self.size = size
+        self.seconds = seconds
+        self.entries = OrderedDict()
+
+    def add(self, search_query, results):
+        key = search_query.key()
+        self.entries[key] = (search_query, results, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def find(self, search_query):
+        """
+        :param search_query: SearchQuery
+        :return: results of the query, None when it has to be searched in database
+        """
+        expired = time.monotonic() - self.seconds
+        for key in [key for key, (_, _, added) in self.entries.items() if added < expired]:
+            del self.entries[key]
+        key = search_query.key()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return list(self.entries[key][1])
+        # the smallest results containing those of the query are filtered
+        refined = [results for query, results, _ in self.entries.values() if search_query.refines(query)]
+        if not refined:
+            return None
+        results = [row for row in min(refined, key=len) if search_query.matches(row)]
+        self.add(search_query, results)
+        return list(results)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SearchRunnerSignals(QObject):
+    page_found = QtCore.pyqtSignal(object, object)
+    count_found = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+
+
+class SearchRunner(QRunnable):
+    """
+    Runs a search on its own connection, for a page of results or for their count
+    a Qt connection is used only by the thread which opened it, so each runner opens one and removes it when done
+    files are searched in steps of ids, a cancelled runner stops at the end of the running step
+    and doesn't send its results, so stale searches don't keep the threads of the pool
+    """
+    # names of connections of runners, unique while their threads run
+    connection_numbers = itertools.count()
+
+    def __init__(self, search_query, sort_column=-1, descending=False, after=None, count=False,
+                 limit=GDBModule.SEARCH_PAGE_SIZE):
+        super().__init__()
+        self.signals = SearchRunnerSignals()
+        self.search_query = search_query
+        self.sort_column = sort_column
+        self.descending = descending
+        self.after = after
+        self.count = count
+        self.limit = limit
+        self.cancelled = False
+        self.connection_name = f'search_connection_{next(SearchRunner.connection_numbers)}'
+
+    @pyqtSlot()
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result = self.search()
+        except Exception as e:
+            result = None
+            if not self.cancelled:
+                self.signals.failed.emit(str(e))
+        finally:
+            # the connection of search is deleted when search returns
+            GDBModule.removeConnection(self.connection_name)
+        if result is not None and not self.cancelled:
+            (self.signals.count_found if self.count else self.signals.page_found).emit(*result)
+
+    def search(self):
+        """ :return: arguments of the signal of result, None if cancelled """
+        con = GDBModule.connection(self.connection_name, 'read-only')
+        try:
+            if not con.isOpen():
+                raise GDBModule.SearchError(con.lastError().text())
+            if self.cancelled:
+                return None
+            if self.count:
+                return (GDBModule.countFoundFiles(con, self.search_query, cancelled=self.isCancelled),)
+            return GDBModule.findFilesPage(con, self.search_query, self.sort_column, self.descending,
+                                           self.after, self.limit, self.isCancelled)
+        finally:
+            con.close()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def isCancelled(self) -> bool:
+        return self.cancelled
@@ -1,5 +1,4 @@
 from PyQt5 import QtCore, QtWidgets, QtGui
-from PyQt5.QtCore import QThreadPool
 from PyQt5.QtWidgets import QTabWidget
 
 from mymodules import GDBModule as gdb
@@ -11,7 +10,7 @@ from mymodules.ExtensionsModule import Extensions
 from mymodules.FoldersModule import Folders
 from mymodules.GDBModule import getPreferenceByName
 from mymodules.GlobalFunctions import setStatusBarMW, getPreference, setPreferenceByName
-from mymodules.IndexerModule import JobRunner
+from mymodules.IndexerModule import IndexScheduler
 from mymodules.PreferencesModule import Preferences
 from mymodules.ReportsModule import Reports
 from mymodules.SearchModule import Search
@@ -26,6 +25,8 @@ class TabsWidget(QtWidgets.QWidget):
         super(TabsWidget, self).__init__(parent)
         self.indexer_thread = None
         self.indexer = None
+        self.runner = None
+        self.drives_progress = {}
         self.monitoring = None
 
         # importing Categories Module
@@ -104,8 +105,11 @@ class TabsWidget(QtWidgets.QWidget):
         self.setProgressBarToStatusBar()
         self.startThreadMonitoringDevices()
         self.parent().kill_device_monitor_runner.connect(lambda: self.killDeviceMonitorRunner())
+        self.parent().kill_device_monitor_runner.connect(lambda: self.stopIndexerOnClose())
+        self.parent().kill_device_monitor_runner.connect(lambda: self.duplicates.cancel())
         self.tabs_settings.currentChanged.connect(self.onChangeTabsOrder)
         self.preferences.change_settings_tab_position.connect(self.setSettingsTabsPosition)
+        self.preferences.preferences_changed.connect(self.search.readPreferences)
         self.drives.remove_drive.connect(self.folders.removeFoldersForDrive)
 
     def setSettingsTabsOrder(self):
@@ -137,6 +141,11 @@ class TabsWidget(QtWidgets.QWidget):
     def killDeviceMonitorRunner(self):
         self.kill_device_monitor_runner.emit()
 
+    def stopIndexerOnClose(self):
+        """ the files found until the application is closed are saved, the next index continues from there """
+        if self.runner:
+            self.runner.stopAndWait()
+
     def setDefaultActions(self):
         self.folders.folder_reindex_button.clicked.connect(self.startThreadIndexer)
         # signals actions
@@ -151,6 +160,10 @@ class TabsWidget(QtWidgets.QWidget):
         self.setStatusButtons(True)
         self.folders.folder_stop_index_button.hide()
         self.setStatusBar(f'Found {self.runner.found_files} files')
+        # statistics of the indexing pipeline show if reading drives or writing database was slower
+        statistics = self.runner.statistics()
+        self.folders.total_folders_indexed_label.setToolTip(
+            "<br>".join(f"{name.replace('_', ' ').capitalize()}: {value}" for name, value in statistics.items()))
         self.folders.indexing_progress_bar.setValue(100)
         self.toggleProgressVisibility(False)
         # show close button
@@ -191,8 +204,9 @@ class TabsWidget(QtWidgets.QWidget):
             self.folders.close_indexed_results_button.hide()
             self.setStatusButtons(False)
             self.folders.folder_stop_index_button.show()
-            self.threadpool = QThreadPool()
-            self.runner = JobRunner()
+            # one indexer for each drive, the drives are indexed at the same time
+            self.runner = IndexScheduler(self)
+            self.drives_progress = {}
             # if indexing for new extension
             # preserve already indexed files
             if self.extensions.last_added_extension:
@@ -202,16 +216,14 @@ class TabsWidget(QtWidgets.QWidget):
                 self.runner.setExtensions({ext_id: extension})
 
             self.setIndexableFolders()
-            self.runner.found_files = 0
 
             self.runner.index_all_types_of_files = int(getPreferenceByName('index_all_types_of_files'))
             self.runner.index_files_without_extension = int(getPreferenceByName('index_files_without_extension'))
-            self.runner.signals.finished.connect(self.onFinished)
-            self.runner.signals.status_folder_changed.connect(self.folders.refreshTable)
-            self.runner.signals.directory_changed.connect(self.onDirectoryChanged)
-            self.runner.signals.match_found.connect(self.onMatchFound)
-            self.threadpool.start(self.runner)
+            self.runner.finished.connect(self.onFinished)
+            self.runner.status_folder_changed.connect(self.folders.refreshTable)
+            self.runner.progress_snapshot.connect(self.onProgressSnapshot)
             self.folders.stop_indexer.connect(self.runner.kill)
+            self.runner.start()
 
     def setIndexableFolders(self):
         indexes = self.folders.folders_indexed_table.selectedIndexes()
@@ -221,17 +233,16 @@ class TabsWidget(QtWidgets.QWidget):
         else:
             folders = gdb.allFolders()
         non_indexable = []
-        indexable_folders = []
         for folder in folders:
             can = folderCanBeIndexed(folder)
             is_indexable = can[0]
             is_not_empty = not isEmptyFolder(folder)
             if is_indexable and is_not_empty:
                 if not isEmptyFolder(folder):
-                    indexable_folders.append(folder)
+                    # folders are grouped by the serial of their drive
+                    self.runner.addFolder(folder, can[1])
             else:
                 non_indexable.append(folder)
-        self.runner.folders_to_index = indexable_folders
         if len(non_indexable):
             non = "<br>".join(non_indexable)
             QtWidgets.QMessageBox.critical(self,
@@ -239,17 +250,25 @@ class TabsWidget(QtWidgets.QWidget):
                                            f"Next folders are empty! Is the source drive active?<br>"
                                            f"<br>{non}")
 
-    @QtCore.pyqtSlot()
-    def onMatchFound(self):
-        self.folders.total_folders_indexed_label.setText(f'Found: {self.runner.found_files} files')
-        self.folders.indexing_progress_bar.setValue(self.runner.percentage)
-
-    @QtCore.pyqtSlot(str)
-    def onDirectoryChanged(self, path):
-        """ New folder is indexing and its path is displayed"""
-        self.folders.report_indexed_path_label.setText(f'Indexing: {path}')
-        self.toggleProgressVisibility(True)
-        self.setStatusBar(f'Indexing: {path}')
+    @QtCore.pyqtSlot(object)
+    def onProgressSnapshot(self, snapshot):
+        """ progress of indexing, received a few times per second """
+        self.folders.total_folders_indexed_label.setText(f'Found: {snapshot["found"]} files')
+        self.folders.report_indexed_path_label.setText(f'Indexing: {snapshot["path"]}')
+        if self.folders.indexing_progress_bar.isHidden():
+            self.toggleProgressVisibility(True)
+        self.folders.indexing_progress_bar.setValue(snapshot['percentage'])
+        self.setDrivesProgress(snapshot['drives'])
+        self.setStatusBar(f'Indexing: {snapshot["path"]} ({snapshot["files_per_second"]} files/s)')
+
+    def setDrivesProgress(self, drives):
+        """ progress of each drive is displayed as tooltip of the progress bar """
+        for serial, percentage in drives.items():
+            if serial not in self.drives_progress:
+                self.drives_progress[serial] = [gdb.getDriveLabelBySerial(serial), percentage]
+            self.drives_progress[serial][1] = percentage
+        tooltip = "<br>".join(f"{label}: {value}%" for label, value in self.drives_progress.values())
+        self.folders.indexing_progress_bar.setToolTip(tooltip)
 
     def toggleProgressVisibility(self, visible):
         if visible: